@@ -1,47 +1,10 @@
 import streamlit as st
-from pages import Image_Coloriser, Video_Coloriser, Youtube_Video_Coloriser, Audio_Enhancement
-import base64
 from PIL import Image
 from streamlit_image_comparison import image_comparison
+from core.theme import apply_theme
 
-# Function to encode the image as base64
-def get_base64_of_image(file_path):
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
-    return encoded_string
-
-# Path to your image
-image_path = 'static/bg.png'
-encoded_image = get_base64_of_image(image_path)
-
-# CSS to inject specifying the background image
-background_image_css = f"""
-<style>
-.stApp {{
-    background-image: url('data:image/png;base64,{encoded_image}');
-    background-size: cover;
-    background-position: center;
-    background-repeat: no-repeat;
-    background-attachment: fixed;
-    color: black;  /* Set text color to black */
-    theme: light; /* Set theme to light */
-}}
-
-/* Style for the sidebar (white with blur effect) */
-.stSidebar {{
-    background-color: #ba90e3; /* Change sidebar color */
-    backdrop-filter: blur(16px);
-}}
-/* Additional styling may be needed for other sidebar elements */
-.css-1l02zno {{
-    background-color: #ba90e3; /* Change sidebar color */
-    backdrop-filter: blur(8px);
-}}
-</style>
-"""
-
-# Inject the CSS with markdown
-st.markdown(background_image_css, unsafe_allow_html=True)
+# Shared background and sidebar styling
+apply_theme()
 
 # Main page title
 st.markdown("# Chroma")
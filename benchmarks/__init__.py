@@ -0,0 +1 @@
+# Performance benchmarks for the Chroma pipelines; see benchmarks/run.py and, for the inference precision modes, benchmarks/precision.py.
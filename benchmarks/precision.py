@@ -0,0 +1,147 @@
+"""Compare the reduced-precision inference modes against fp32 on the sample media.
+
+Run from the repository root (needs the real DeOldify weights):
+
+    python -m benchmarks.precision                      # every mode
+    python -m benchmarks.precision bf16 traced          # fp32 plus these modes
+
+The sample image (render factor 35) and every frame of the sample video
+(render factor 10) are colorized in each mode. For each mode the report
+gives the model load time, the time per image or frame after a warm-up
+pass, the speed-up over fp32, and how far the output drifts from fp32:
+PSNR over RGB and the mean and 99th percentile chroma difference in CIELAB
+a*b* (a difference of about 2 is the smallest most viewers notice).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.run import IMAGE, IMAGE_RENDER_FACTOR, VIDEO, VIDEO_RENDER_FACTOR
+from core.precision import PRECISIONS
+
+
+def _image_inputs():
+    from PIL import Image
+    return [np.asarray(Image.open(IMAGE).convert('RGB'))]
+
+
+def _video_inputs():
+    import cv2
+
+    from core.video import read_frames
+    return [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in read_frames(VIDEO)]
+
+
+def colorize_all(images, render_factor, kind, precision, batch_size, iterations):
+    """Colorize `images` in `precision`; returns (outputs, load seconds, seconds per image)."""
+    from core import models
+    from core.colorize import colorize_batch
+
+    start = time.perf_counter()
+    models.get_model(kind, 'cpu', precision)
+    load_seconds = time.perf_counter() - start
+
+    def run():
+        outputs = []
+        with models.lease(kind, 'cpu', precision) as colorizer:
+            for i in range(0, len(images), batch_size):
+                outputs.extend(colorize_batch(colorizer, images[i:i + batch_size], render_factor,
+                                              watermarked=False))
+        return outputs
+
+    # Traced graphs are built and caches filled on the first pass
+    outputs = run()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        outputs = run()
+    seconds = (time.perf_counter() - start) / (iterations * len(images))
+    return outputs, load_seconds, seconds
+
+
+def drift(outputs, references):
+    """PSNR and a*b* chroma difference of `outputs` against `references`."""
+    import cv2
+
+    squared_errors = []
+    chroma = []
+    for output, reference in zip(outputs, references):
+        squared_errors.append(np.mean((output.astype(np.float32) - reference.astype(np.float32)) ** 2))
+        lab_output = cv2.cvtColor(output.astype(np.float32) / 255, cv2.COLOR_RGB2LAB)
+        lab_reference = cv2.cvtColor(reference.astype(np.float32) / 255, cv2.COLOR_RGB2LAB)
+        chroma.append(np.hypot(*(lab_output[..., 1:] - lab_reference[..., 1:]).transpose(2, 0, 1)).ravel())
+    mse = float(np.mean(squared_errors))
+    chroma = np.concatenate(chroma)
+    return {
+        'psnr_db': round(float(10 * np.log10(255 ** 2 / mse)), 2) if mse else None,
+        'chroma_delta_mean': round(float(chroma.mean()), 3),
+        'chroma_delta_p99': round(float(np.percentile(chroma, 99)), 3),
+    }
+
+
+def compare_media(name, images, render_factor, kind, precisions, batch_size, iterations):
+    report = {}
+    references = None
+    for precision in precisions:
+        outputs, load_seconds, seconds = colorize_all(images, render_factor, kind, precision, batch_size,
+                                                      iterations)
+        entry = {'load_seconds': round(load_seconds, 2), 'seconds_per_item': round(seconds, 4)}
+        if precision == 'fp32':
+            references = outputs
+        else:
+            entry['speedup'] = round(report['fp32']['seconds_per_item'] / seconds, 2)
+            entry.update(drift(outputs, references))
+        report[precision] = entry
+        print(f"{name:<6} {precision:<14} {json.dumps(entry)}", file=sys.stderr)
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.precision', description=__doc__.split('\n')[0])
+    parser.add_argument('precisions', nargs='*',
+                        help=f"modes to compare with fp32 (default: all of {', '.join(PRECISIONS[1:])})")
+    parser.add_argument('--kind', default='artistic', choices=['artistic', 'video'])
+    parser.add_argument('--iterations', type=int, default=3, help="timed passes over each sample")
+    parser.add_argument('--batch-size', type=int, default=4, help="video frames per forward pass")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+    unknown = set(args.precisions) - set(PRECISIONS)
+    if unknown:
+        parser.error(f"unknown precisions: {', '.join(sorted(unknown))}")
+    precisions = ['fp32'] + [p for p in (args.precisions or PRECISIONS) if p != 'fp32']
+
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'threads': torch.get_num_threads(),
+            'kind': args.kind,
+            'iterations': args.iterations,
+        },
+        'image': compare_media('image', _image_inputs(), IMAGE_RENDER_FACTOR, args.kind, precisions, 1,
+                               args.iterations),
+        'video': compare_media('video', _video_inputs(), VIDEO_RENDER_FACTOR, args.kind, precisions,
+                               args.batch_size, args.iterations),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
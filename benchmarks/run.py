@@ -0,0 +1,287 @@
+"""Benchmark every pipeline stage on the bundled sample media.
+
+Run from the repository root:
+
+    python -m benchmarks.run                     # every stage, stand-in models
+    python -m benchmarks.run image_colorize mux  # specific stages
+    python -m benchmarks.run --save-baseline     # record this machine's baseline
+    python -m benchmarks.run --real-models       # time the real DeOldify/VoiceFixer
+
+Each stage reports throughput, per-item latency percentiles and the peak
+RSS while it ran, as JSON. When a baseline report exists (by default
+benchmarks/baseline.json) the run is compared against it and the exit
+status is 1 if any stage's throughput dropped by more than --tolerance.
+Baselines are machine-specific: record one before changing the code
+and compare on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from core.batch import IMAGE_RENDER_FACTOR, VIDEO_RENDER_FACTOR
+from core.resources import rss_bytes
+
+VIDEO = os.path.join('Data', 'Test video.mp4')
+AUDIO = os.path.join('Data', 'Test audio.wav')
+IMAGE = os.path.join('static', 'Test.jpeg')
+
+BASELINE = os.path.join('benchmarks', 'baseline.json')
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_image_colorize(iterations, scratch):
+    from core.pipeline import colorize_image_file
+    output_path = os.path.join(scratch, 'image.jpg')
+    latencies = [_timed(colorize_image_file, IMAGE, output_path, IMAGE_RENDER_FACTOR, watermarked=False)
+                 for _ in range(iterations)]
+    return latencies, iterations
+
+
+def bench_video_decode(iterations, scratch):
+    from core.video import read_frames
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for _ in read_frames(VIDEO):
+            now = time.perf_counter()
+            latencies.append(now - start)
+            start = now
+    return latencies, len(latencies)
+
+
+def _frames():
+    from core.video import read_frames
+    return list(read_frames(VIDEO))
+
+
+def bench_video_colorize(iterations, scratch):
+    from core.pipeline import colorize_frames
+    frames = _frames()
+    latencies = [_timed(colorize_frames, [frame], VIDEO_RENDER_FACTOR, watermarked=False)
+                 for _ in range(iterations) for frame in frames]
+    return latencies, len(latencies)
+
+
+def bench_video_encode(iterations, scratch):
+    import cv2
+
+    from core.video import FrameWriter, source_fps
+    frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in _frames()]
+    latencies = []
+    for _ in range(iterations):
+        # Writes only block once the encoder falls behind, so spread the
+        # final flush over the frames to get per-frame cost
+        start = time.perf_counter()
+        with FrameWriter(os.path.join(scratch, 'encode.mp4'), fps=source_fps(VIDEO)) as writer:
+            for frame in frames:
+                writer.write(frame)
+        latencies.extend([(time.perf_counter() - start) / len(frames)] * len(frames))
+    return latencies, len(latencies)
+
+
+def bench_mux(iterations, scratch):
+    import cv2
+
+    from core.video import FrameWriter, concat_segments, source_fps
+    silent = os.path.join(scratch, 'silent.mp4')
+    with FrameWriter(silent, fps=source_fps(VIDEO)) as writer:
+        for frame in _frames():
+            writer.write(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    output_path = os.path.join(scratch, 'muxed.mp4')
+    latencies = [_timed(concat_segments, [silent], output_path, audio_path=VIDEO) for _ in range(iterations)]
+    return latencies, iterations
+
+
+def _load_audio():
+    from core.audio import read_chunks
+    return np.concatenate(list(read_chunks(AUDIO)))
+
+
+def bench_audio_load(iterations, scratch):
+    latencies = [_timed(_load_audio) for _ in range(iterations)]
+    return latencies, iterations
+
+
+def bench_spectrogram(iterations, scratch):
+    from core import spectrogram
+    from core.audio import SAMPLE_RATE
+    samples = _load_audio()
+    latencies = []
+    for _ in range(iterations):
+        # Time the computation, not the per-audio cache
+        spectrogram._cache.clear()
+        latencies.append(_timed(spectrogram.render_spectrogram, samples, SAMPLE_RATE))
+    return latencies, iterations
+
+
+def bench_voicefixer_restore(iterations, scratch):
+    from core.audio import restore_chunked
+    output_path = os.path.join(scratch, 'restored.wav')
+    latencies = [_timed(restore_chunked, AUDIO, output_path) for _ in range(iterations)]
+    return latencies, iterations
+
+
+# Stage name -> (function, unit its items are counted in)
+STAGES = {
+    'image_colorize': (bench_image_colorize, 'images'),
+    'video_decode': (bench_video_decode, 'frames'),
+    'video_colorize': (bench_video_colorize, 'frames'),
+    'video_encode': (bench_video_encode, 'frames'),
+    'mux': (bench_mux, 'files'),
+    'audio_load': (bench_audio_load, 'files'),
+    'spectrogram': (bench_spectrogram, 'files'),
+    'voicefixer_restore': (bench_voicefixer_restore, 'files'),
+}
+
+
+class _PeakRSS:
+    """Sample the process RSS on a background thread and keep the maximum."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def run_stage(name, iterations=5, warmup=1):
+    """Run one stage and return its report entry."""
+    fn, unit = STAGES[name]
+    scratch = tempfile.mkdtemp(prefix=f'bench-{name}-')
+    try:
+        if warmup:
+            # Loads models and fills OS caches; not counted
+            fn(warmup, scratch)
+        rss_before = rss_bytes()
+        with _PeakRSS() as peak:
+            latencies, items = fn(iterations, scratch)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    # Stage set-up (decoding input frames etc.) is excluded from the latencies
+    seconds = float(np.sum(latencies))
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'unit': unit,
+        'items': items,
+        'seconds': round(seconds, 4),
+        'throughput': round(items / seconds, 3) if seconds else None,
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p90': round(float(np.percentile(latencies_ms, 90)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+            'mean': round(float(latencies_ms.mean()), 3),
+        },
+        'peak_rss_mb': round(peak.peak / 2**20, 1),
+        'rss_growth_mb': round((peak.peak - rss_before) / 2**20, 1),
+    }
+
+
+def compare(report, baseline, tolerance=0.1):
+    """Print each stage against the baseline; returns the names of regressed stages."""
+    regressed = []
+    print(f"{'stage':<20} {'throughput':>22} {'p50 latency':>24} {'peak RSS':>18}", file=sys.stderr)
+    for name, stage in report['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if 'error' in stage or base is None or 'error' in base:
+            continue
+        ratio = stage['throughput'] / base['throughput'] if base['throughput'] else float('nan')
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        print(f"{name:<20} {base['throughput']:>9.2f} -> {stage['throughput']:<9.2f} ({ratio:4.2f}x)"
+              f" {base['latency_ms']['p50']:>9.1f} -> {stage['latency_ms']['p50']:<9.1f} ms"
+              f" {base['peak_rss_mb']:>7.0f} -> {stage['peak_rss_mb']:<7.0f}MB{flag}", file=sys.stderr)
+    return regressed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.split('\n')[0])
+    parser.add_argument('stages', nargs='*', help=f"stages to run (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--iterations', type=int, default=5, help="passes over the sample media per stage")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    parser.add_argument('--baseline', default=BASELINE, help="report to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="throughput drop (fraction) counted as a regression")
+    parser.add_argument('--real-models', action='store_true',
+                        help="time the real DeOldify and VoiceFixer models instead of the stand-ins")
+    args = parser.parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if not args.real_models:
+        from benchmarks import standin
+        standin.install()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'models': 'real' if args.real_models else 'stand-in',
+            'iterations': args.iterations,
+        },
+        'stages': {},
+    }
+    for name in args.stages or STAGES:
+        try:
+            report['stages'][name] = run_stage(name, args.iterations, args.warmup)
+        except Exception as e:
+            # Missing optional dependencies only skip their stage
+            report['stages'][name] = {'error': f"{type(e).__name__}: {e}"}
+        print(f"{name:<20} {json.dumps(report['stages'][name])}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('models') != report['meta']['models']:
+            print("Baseline was recorded with different models; not comparing", file=sys.stderr)
+            return 0
+        regressed = compare(report, baseline, args.tolerance)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
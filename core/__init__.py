@@ -0,0 +1,3 @@
+# Shared building blocks for the Chroma pages. Modules here keep their heavy
+# imports (torch, deoldify, librosa, ...) inside functions so importing the
+# package stays cheap.
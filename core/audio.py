@@ -0,0 +1,236 @@
+import math
+import os
+import struct
+from contextlib import nullcontext
+
+import numpy as np
+
+from core import metrics, models
+
+# VoiceFixer works on 44.1 kHz mono
+SAMPLE_RATE = 44100
+# VoiceFixer.restore_inmem cuts its input into segments of this length and
+# normalises each on its own, so a longer window gets a hard cut inside it
+VOICEFIXER_SEGMENT_SECONDS = 30
+# Chunked restores step this far and overlap by this much, so each window
+# is exactly one VoiceFixer segment
+CHUNK_SECONDS = 29
+OVERLAP_SECONDS = 1
+
+# (WAVE format tag, bits per sample) -> sample dtype that can be mapped as is
+_WAV_DTYPES = {(1, 16): '<i2', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8'}
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def map_wav(path):
+    """Memory-map the samples of an uncompressed WAV file.
+
+    Returns `(frames x channels array, samplerate)` backed by the file, or
+    None when it is not 16/32-bit integer or 32/64-bit float PCM (or not a
+    WAV file at all). The mapping is copy-on-write, so callers that modify
+    samples in place never touch the file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                f.seek(size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                # Chunks are padded to an even length
+                f.seek(size + size % 2, os.SEEK_CUR)
+    if fmt is None or len(fmt) < 16:
+        return None
+    tag, channels, samplerate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        tag = struct.unpack('<H', fmt[24:26])[0]
+    dtype = _WAV_DTYPES.get((tag, bits))
+    if dtype is None or not channels or block_align != channels * bits // 8:
+        return None
+    # Streamed writers leave the size at 0 or 0xFFFFFFFF; the data then runs to the end
+    size = min(size or 2**32, os.path.getsize(path) - offset)
+    frames = size // block_align
+    if not frames:
+        return np.zeros((0, channels), dtype=dtype), samplerate
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=(frames, channels)), samplerate
+
+
+def to_mono(frames):
+    """Mix `frames x channels` samples down to float32 in [-1, 1].
+
+    Mono float32 input is returned as a view; anything else is converted
+    with a single copy.
+    """
+    if frames.dtype == np.float32 and frames.shape[1] == 1:
+        return frames[:, 0]
+    if frames.shape[1] == 1:
+        mono = frames[:, 0].astype(np.float32)
+    else:
+        mono = frames.mean(axis=1, dtype=np.float32)
+    if frames.dtype.kind == 'i':
+        mono *= 1.0 / 2 ** (8 * frames.dtype.itemsize - 1)
+    return mono
+
+
+def load_audio(path, offset=0.0, duration=None):
+    """Decode the audio file at `path` once into mono float32 at its own sample rate.
+
+    WAV files are memory-mapped, so only the `duration` seconds from
+    `offset` are read from disk. Returns `(samples, samplerate)`; pass the
+    result through `resample` if a consumer needs another rate.
+    """
+    import soundfile as sf
+
+    with metrics.stage('audio_load'):
+        mapped = map_wav(path)
+        if mapped is not None:
+            frames, samplerate = mapped
+            start = int(offset * samplerate)
+            stop = None if duration is None else start + int(duration * samplerate)
+            return to_mono(frames[start:stop]), samplerate
+        with sf.SoundFile(path) as f:
+            f.seek(int(offset * f.samplerate))
+            count = -1 if duration is None else int(duration * f.samplerate)
+            return to_mono(f.read(count, dtype='float32', always_2d=True)), f.samplerate
+
+
+def resample(samples, samplerate, target=SAMPLE_RATE):
+    """Return `samples` at `target` Hz; the same array when the rate already matches."""
+    if samplerate == target:
+        return samples
+    import librosa
+    with metrics.stage('resample'):
+        return librosa.resample(samples, orig_sr=samplerate, target_sr=target)
+
+
+def _restore_array(wav, mode=0):
+    """Restore a 44.1 kHz mono array with the shared VoiceFixer.
+
+    VoiceFixer's inference is re-entrant in modes 0 and 1 (the model stays
+    in eval mode), so concurrent sessions share one instance without
+    queueing behind each other. Mode 2 puts the model in train mode, so it
+    takes an exclusive lease on a separate instance that the eval-mode
+    restores never see.
+    """
+    if mode == 2:
+        model = models.lease('voicefixer_train', 'cpu')
+    else:
+        model = nullcontext(models.get_model('voicefixer', 'cpu'))
+    with model as vf, metrics.stage('restore', memory=True, mode=mode):
+        restored = vf.restore_inmem(wav, cuda=False, mode=mode)
+    return np.asarray(restored, dtype=np.float32).reshape(-1)
+
+
+def count_chunks(frames, samplerate, chunk_seconds, overlap_seconds):
+    step = int(chunk_seconds * samplerate)
+    overlap = int(overlap_seconds * samplerate)
+    return max(1, math.ceil((frames - overlap) / step))
+
+
+def read_chunks(path, chunk_seconds=CHUNK_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """Yield overlapping mono 44.1 kHz windows of the audio file at `path`.
+
+    Each window is `chunk_seconds` long plus `overlap_seconds` shared with
+    the next one. Only one window is decoded at a time; WAV files are read
+    straight from a memory mapping, and resampled only if they are not
+    already at 44.1 kHz.
+    """
+    import soundfile as sf
+
+    mapped = map_wav(path)
+    if mapped is not None:
+        frames, samplerate = mapped
+        step = int(chunk_seconds * samplerate)
+        length = step + int(overlap_seconds * samplerate)
+        for index in range(count_chunks(len(frames), samplerate, chunk_seconds, overlap_seconds)):
+            with metrics.stage('audio_decode'):
+                chunk = resample(to_mono(frames[index * step:index * step + length]), samplerate)
+            yield chunk
+        return
+
+    with sf.SoundFile(path) as f:
+        step = int(chunk_seconds * f.samplerate)
+        length = step + int(overlap_seconds * f.samplerate)
+        for index in range(count_chunks(f.frames, f.samplerate, chunk_seconds, overlap_seconds)):
+            with metrics.stage('audio_decode'):
+                f.seek(index * step)
+                chunk = resample(to_mono(f.read(length, dtype='float32', always_2d=True)), f.samplerate)
+            yield chunk
+
+
+def stitch(chunks, overlap_seconds=OVERLAP_SECONDS):
+    """Join restored overlapping chunks, crossfading across each overlap.
+
+    Yields the output piece by piece, holding back only the overlap tail
+    of the latest chunk.
+    """
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    tail = None
+    for chunk in chunks:
+        if tail is not None:
+            n = min(len(tail), len(chunk))
+            # Linear fade: both sides restore the same audio, so they are correlated
+            fade_in = np.linspace(0.0, 1.0, n, endpoint=False, dtype=np.float32)
+            yield tail[:n] * (1.0 - fade_in) + chunk[:n] * fade_in
+            chunk = chunk[n:]
+        if len(chunk) > overlap:
+            yield chunk[:len(chunk) - overlap]
+            tail = chunk[len(chunk) - overlap:]
+        else:
+            tail = chunk
+    if tail is not None and len(tail):
+        yield tail
+
+
+def restore_chunked(input_path, output_path, chunk_seconds=CHUNK_SECONDS, overlap_seconds=OVERLAP_SECONDS,
+                    workers=1, threads_per_worker=1, mode=0, report=None):
+    """Restore an audio file of any length in overlapping chunks.
+
+    Memory stays bounded by a few chunks regardless of file length. With
+    `workers` > 1 the chunks are restored in parallel on CPU worker
+    processes, each holding its own VoiceFixer. The output is written to
+    `output_path` as it is stitched; `report(progress, message, preview)`
+    receives each finished chunk as a preview. Raises ValueError if a
+    window (`chunk_seconds` + `overlap_seconds`) is longer than one
+    VoiceFixer segment, whose internal cuts the crossfade could not hide.
+    """
+    import soundfile as sf
+
+    if chunk_seconds + overlap_seconds > VOICEFIXER_SEGMENT_SECONDS:
+        raise ValueError(f"Chunks of {chunk_seconds}s plus {overlap_seconds}s of overlap exceed "
+                         f"VoiceFixer's {VOICEFIXER_SEGMENT_SECONDS}s segments")
+
+    info = sf.info(input_path)
+    total = count_chunks(info.frames, info.samplerate, chunk_seconds, overlap_seconds)
+    chunks = read_chunks(input_path, chunk_seconds, overlap_seconds)
+
+    if report:
+        report(0.0, 'Loading VoiceFixer')
+    if workers > 1:
+        from core.parallel import get_pool, map_ordered
+        pool = get_pool('voicefixer', workers, threads_per_worker)
+        restored = map_ordered(pool, _restore_array, ((chunk, mode) for chunk in chunks), inflight=workers * 2)
+    else:
+        restored = (_restore_array(chunk, mode) for chunk in chunks)
+
+    def progress(restored):
+        for index, chunk in enumerate(restored, 1):
+            if report:
+                report(index / total, f"Restored chunk {index} of {total}", chunk)
+            yield chunk
+
+    with sf.SoundFile(output_path, 'w', samplerate=SAMPLE_RATE, channels=1, subtype='PCM_16') as out:
+        for piece in stitch(progress(restored), overlap_seconds):
+            with metrics.stage('audio_write'):
+                out.write(piece)
+    return output_path
@@ -0,0 +1,281 @@
+"""Colorize folders of images and videos without the web app.
+
+Run from the repository root:
+
+    python -m core.batch scans/ --output colorized/
+    python -m core.batch manifest.jsonl --output colorized/ --workers 4
+
+Inputs are files, directories (searched recursively) or manifests: a
+``.jsonl`` file with one ``{"input": ..., "output": ..., "render_factor": ...}``
+object per line (only ``input`` is required), or a ``.txt`` file with one
+path per line. Outputs mirror the inputs' paths: ``scan.jpg`` becomes
+``scan.jpg`` and ``scan.png`` becomes ``scan.png.jpg``. Items whose output
+already exists are skipped, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from core.parallel import get_pool, map_ordered
+from core.pipeline import colorize_video_file
+from core.precision import DEFAULT_PRECISION, PRECISIONS
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+
+# Same defaults as the pages' sliders
+IMAGE_RENDER_FACTOR = 35
+VIDEO_RENDER_FACTOR = 10
+
+
+class Item:
+    """One input file and where its colorized version goes."""
+
+    def __init__(self, input_path, output_path, render_factor=None):
+        self.input = input_path
+        self.output = output_path
+        self.render_factor = render_factor
+
+    @property
+    def is_video(self):
+        return self.input.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def _output_for(input_path, output_dir, root=None):
+    relative = os.path.relpath(input_path, root) if root else os.path.basename(input_path)
+    stem, ext = os.path.splitext(relative)
+    output_ext = '.mp4' if input_path.lower().endswith(VIDEO_EXTENSIONS) else '.jpg'
+    # Keep any other extension so scan.png and scan.jpg do not both become scan.jpg
+    if ext.lower() != output_ext:
+        stem = relative
+    return os.path.join(output_dir, stem + output_ext)
+
+
+def _read_manifest(path, output_dir):
+    base = os.path.dirname(path)
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith('.jsonl'):
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{number}: {e}") from None
+                if not isinstance(entry, dict) or 'input' not in entry:
+                    raise ValueError(f"{path}:{number}: entries need an \"input\" path")
+            else:
+                entry = {'input': line}
+            input_path = os.path.join(base, entry['input'])
+            output_path = entry.get('output')
+            output_path = (os.path.join(output_dir, output_path) if output_path
+                           else _output_for(input_path, output_dir))
+            yield Item(input_path, output_path, entry.get('render_factor'))
+
+
+def collect(inputs, output_dir):
+    """Expand files, directories and manifests into a list of Items.
+
+    Raises ValueError for malformed manifest lines and if two different
+    inputs map to the same output.
+    """
+    items = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                        input_path = os.path.join(dirpath, filename)
+                        items.append(Item(input_path, _output_for(input_path, output_dir, root=path)))
+        elif path.endswith(('.jsonl', '.txt')):
+            items.extend(_read_manifest(path, output_dir))
+        else:
+            items.append(Item(path, _output_for(path, output_dir)))
+
+    sources = {}
+    for item in items:
+        output = os.path.normcase(os.path.abspath(item.output))
+        if output in sources and sources[output] != item.input:
+            raise ValueError(f"{sources[output]} and {item.input} would both be written to {item.output}")
+        sources[output] = item.input
+    return items
+
+
+def _partial_path(output_path):
+    root, ext = os.path.splitext(output_path)
+    return root + '.part' + ext
+
+
+def colorize_images(items, render_factor, watermarked=True, kind='artistic', precision='fp32'):
+    """Colorize a list of `(input, output)` image paths with one forward pass.
+
+    Runs in this process or in a pool worker, with that process's shared
+    model. Each output is written under a temporary name and renamed when
+    complete. Returns a list of error strings (None for successes).
+    """
+    from PIL import Image
+
+    from core.colorize import check_image_size
+    from core.pipeline import colorize_images
+
+    images = []
+    errors = [None] * len(items)
+    for i, (input_path, _) in enumerate(items):
+        try:
+            image = Image.open(input_path)
+            check_image_size(*image.size)
+            images.append(image.convert('RGB'))
+        except Exception as e:
+            errors[i] = f"{type(e).__name__}: {e}"
+            images.append(None)
+
+    loaded = [i for i, image in enumerate(images) if image is not None]
+    if not loaded:
+        return errors
+    try:
+        colorized = colorize_images([images[i] for i in loaded], render_factor, kind, watermarked=watermarked,
+                                    precision=precision)
+    except Exception as e:
+        for i in loaded:
+            errors[i] = f"{type(e).__name__}: {e}"
+        return errors
+    for i, result in zip(loaded, colorized):
+        output_path = items[i][1]
+        try:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            partial = _partial_path(output_path)
+            Image.fromarray(result).save(partial, format='JPEG')
+            os.replace(partial, output_path)
+        except OSError as e:
+            errors[i] = f"{type(e).__name__}: {e}"
+    return errors
+
+
+def _image_batches(items, batch_size):
+    # Batch images that share a render factor
+    groups = {}
+    for item in items:
+        groups.setdefault(item.render_factor, []).append(item)
+    for render_factor, group in groups.items():
+        for i in range(0, len(group), batch_size):
+            yield render_factor, group[i:i + batch_size]
+
+
+def run(items, kind='artistic', image_render_factor=IMAGE_RENDER_FACTOR,
+        video_render_factor=VIDEO_RENDER_FACTOR, workers=0, threads_per_worker=1, batch_size=4,
+        watermarked=True, force=False, precision='fp32', video_options=None):
+    """Colorize `items`, skipping those already done; returns a summary dict."""
+    summary = {'images': 0, 'videos': 0, 'frames': 0, 'skipped': 0, 'failed': 0,
+               'image_seconds': 0.0, 'video_seconds': 0.0, 'failures': []}
+
+    pending = []
+    for item in items:
+        if not force and os.path.exists(item.output):
+            summary['skipped'] += 1
+            continue
+        if item.render_factor is None:
+            item.render_factor = video_render_factor if item.is_video else image_render_factor
+        pending.append(item)
+    images = [item for item in pending if not item.is_video]
+    videos = [item for item in pending if item.is_video]
+    logger.info("%d images and %d videos to colorize, %d already done",
+                len(images), len(videos), summary['skipped'])
+
+    def record(item, error):
+        logger.error("%s: %s", item.input, error)
+        summary['failed'] += 1
+        summary['failures'].append({'input': item.input, 'error': error})
+
+    start = time.perf_counter()
+    batches = list(_image_batches(images, batch_size))
+    argsets = [([(item.input, item.output) for item in batch], render_factor, watermarked, kind, precision)
+               for render_factor, batch in batches]
+    if workers:
+        # Each worker holds its own model and colorizes whole batches
+        pool = get_pool(kind, workers, threads_per_worker, precision)
+        outcomes = map_ordered(pool, colorize_images, argsets, inflight=workers * 2)
+    else:
+        outcomes = (colorize_images(*args) for args in argsets)
+    for (_, batch), errors in zip(batches, outcomes):
+        for item, error in zip(batch, errors):
+            if error is None:
+                summary['images'] += 1
+            else:
+                record(item, error)
+        logger.info("%d / %d images", summary['images'] + summary['failed'], len(images))
+    summary['image_seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for item in videos:
+        os.makedirs(os.path.dirname(item.output) or '.', exist_ok=True)
+        partial = _partial_path(item.output)
+        try:
+            stats = colorize_video_file(item.input, partial, item.render_factor, kind=kind,
+                                        workers=workers, threads_per_worker=threads_per_worker,
+                                        precision=precision, **(video_options or {}))
+            if not stats['frames']:
+                raise RuntimeError("no frames could be read")
+            os.replace(partial, item.output)
+        except Exception as e:
+            record(item, f"{type(e).__name__}: {e}")
+            continue
+        summary['videos'] += 1
+        summary['frames'] += stats['frames']
+    summary['video_seconds'] = time.perf_counter() - start
+    return summary
+
+
+def format_summary(summary):
+    lines = [f"Colorized {summary['images']} images and {summary['videos']} videos "
+             f"({summary['skipped']} skipped, {summary['failed']} failed)"]
+    if summary['images']:
+        lines.append(f"  images: {summary['image_seconds']:.1f}s, "
+                     f"{summary['images'] / summary['image_seconds']:.2f} images/s")
+    if summary['frames']:
+        lines.append(f"  videos: {summary['frames']} frames in {summary['video_seconds']:.1f}s, "
+                     f"{summary['frames'] / summary['video_seconds']:.2f} frames/s")
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m core.batch', description=__doc__.split('\n')[0])
+    parser.add_argument('inputs', nargs='+', help="image/video files, directories or manifests")
+    parser.add_argument('--output', '-o', required=True, help="directory for the colorized files")
+    parser.add_argument('--kind', default='artistic', choices=['artistic', 'video'])
+    parser.add_argument('--image-render-factor', type=int, default=IMAGE_RENDER_FACTOR)
+    parser.add_argument('--video-render-factor', type=int, default=VIDEO_RENDER_FACTOR)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="CPU worker processes, each with its own model (0 = run in this process)")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=4, help="images per forward pass")
+    parser.add_argument('--no-watermark', action='store_true')
+    parser.add_argument('--force', action='store_true', help="redo items whose output already exists")
+    parser.add_argument('--precision', default=DEFAULT_PRECISION, choices=PRECISIONS,
+                        help="generator inference mode; see core/precision.py")
+    parser.add_argument('--report', help="also write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        items = collect(args.inputs, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    summary = run(items, kind=args.kind, image_render_factor=args.image_render_factor,
+                  video_render_factor=args.video_render_factor, workers=args.workers,
+                  threads_per_worker=args.threads_per_worker, batch_size=args.batch_size,
+                  watermarked=not args.no_watermark, force=args.force, precision=args.precision)
+    print(format_summary(summary))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+CACHE_DIR = os.environ.get('CHROMA_CACHE_DIR', os.path.join('.cache', 'results'))
+CACHE_MAX_BYTES = int(os.environ.get('CHROMA_CACHE_MAX_MB', '2048')) * 2**20
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=2**20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of colorized outputs, keyed by input content and settings.
+
+    Entries are plain files named by key. A hit refreshes the file's mtime,
+    and once the cache grows past `max_bytes` the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash, **params):
+        """Combine an input's content hash with the settings that shape the output."""
+        settings = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{content_hash}:{settings}".encode()).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, key + suffix)
+
+    def get(self, key, suffix):
+        """Return the cached file path for `key`, or None on a miss."""
+        path = self._path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put_bytes(self, key, suffix, data):
+        """Store `data` under `key` and return the cached path."""
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self._commit(temp_path, key, suffix)
+
+    def put_file(self, key, suffix, source_path):
+        """Move `source_path` into the cache under `key` and return the cached path."""
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        os.close(fd)
+        try:
+            os.replace(source_path, temp_path)
+        except OSError:
+            # Different filesystem: fall back to a copy
+            import shutil
+            shutil.copyfile(source_path, temp_path)
+        return self._commit(temp_path, key, suffix)
+
+    def _commit(self, temp_path, key, suffix):
+        # Rename into place so readers never see a partially written entry
+        path = self._path(key, suffix)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+        return path
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits `max_bytes`.
+
+        `keep` is never removed, so an entry larger than the whole budget
+        still survives until the next insert.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size_mb': round(sum(size for _, size, _ in entries) / 2**20, 1),
+            'max_mb': round(self.max_bytes / 2**20, 1),
+        }
+
+
+# Process-wide cache shared by all pages
+results = ResultCache()
@@ -0,0 +1,213 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from core import metrics, precision
+from core.resources import available_memory
+
+# Rough peak inference memory per pixel of the square model input. DeOldify's
+# U-Net activations dominate; this errs on the high side so auto-sized
+# batches leave room for decode/encode buffers.
+BYTES_PER_MODEL_PIXEL = 4096
+
+# Working memory for laying chroma over a full-res image; larger images are
+# processed in strips. Counts the YUV strip plus float interpolation buffers.
+TILE_MEMORY = int(os.environ.get('CHROMA_TILE_MEMORY_MB', '64')) * 2**20
+BYTES_PER_STRIP_PIXEL = 32
+
+# Full-resolution copies alive at once while colorizing one image: the
+# decoded image and its array, the result, DeOldify's RGBA watermark passes
+# and the encoder's input. The strips above only bound apply_chroma's share,
+# so image size is capped to fit IMAGE_MEMORY.
+BYTES_PER_IMAGE_PIXEL = 32
+IMAGE_MEMORY = int(os.environ.get('CHROMA_IMAGE_MEMORY_MB', '2048')) * 2**20
+
+# Side of the model input per render factor step (ColorizerFilter.render_base)
+RENDER_BASE = 16
+
+
+def auto_batch_size(render_factor, max_batch=16, memory_fraction=0.5, render_base=RENDER_BASE):
+    """Pick how many frames to colorize per forward pass.
+
+    Sized to fit `memory_fraction` of the currently available RAM at the
+    given render factor, clamped to [1, max_batch].
+    """
+    available = available_memory()
+    if available is None:
+        return 4
+    render_sz = render_factor * render_base
+    per_frame = render_sz * render_sz * BYTES_PER_MODEL_PIXEL
+    return max(1, min(max_batch, int(available * memory_fraction // per_frame)))
+
+
+def max_image_pixels(memory_budget=None):
+    """Largest image, in pixels, that can be colorized within `memory_budget` bytes (default IMAGE_MEMORY)."""
+    limit = (memory_budget or IMAGE_MEMORY) // BYTES_PER_IMAGE_PIXEL
+    if Image.MAX_IMAGE_PIXELS:
+        # PIL refuses to decode anything over twice its decompression-bomb threshold
+        limit = min(limit, 2 * Image.MAX_IMAGE_PIXELS)
+    return int(limit)
+
+
+def check_image_size(width, height):
+    """Raise ValueError if a `width` x `height` image exceeds max_image_pixels()."""
+    limit = max_image_pixels()
+    if width * height > limit:
+        raise ValueError(f"The image is {width}x{height} ({width * height / 1e6:.0f} MP); "
+                         f"images up to {limit / 1e6:.0f} MP can be colorized")
+
+
+def _to_rgb_array(image):
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert('RGB'))
+    return image
+
+
+def model_ready_image(image_rgb, render_sz):
+    """Shrink an RGB array to the generator's grayscale `render_sz` square.
+
+    Array equivalent of ColorizerFilter._get_model_ready_image: stretch to
+    the square, then drop to luminance and back to three channels.
+    """
+    import cv2
+    square = cv2.resize(image_rgb, (render_sz, render_sz), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(cv2.cvtColor(square, cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+
+
+def _strip_rows(width, memory_budget):
+    return max(16, int(memory_budget // (width * BYTES_PER_STRIP_PIXEL)))
+
+
+def apply_chroma(color_rgb, orig_rgb, memory_budget=None):
+    """Combine the chroma of a low-res colorization with the full-res luminance of `orig_rgb`.
+
+    Same result as DeOldify's `_unsquare` + `_post_process`, but only the
+    two chroma planes are upsampled, never a full-res RGB intermediate.
+    Images whose working set would exceed `memory_budget` bytes (default
+    TILE_MEMORY) are processed in horizontal strips. The chroma is
+    interpolated from the one low-res prediction either way, so strips
+    line up without seams.
+    """
+    import cv2
+    height, width = orig_rgb.shape[:2]
+    chroma = cv2.cvtColor(color_rgb, cv2.COLOR_RGB2YUV)[:, :, 1:3]
+    strip_rows = _strip_rows(width, memory_budget or TILE_MEMORY)
+
+    if strip_rows >= height:
+        yuv = cv2.cvtColor(orig_rgb, cv2.COLOR_RGB2YUV)
+        yuv[:, :, 1:3] = cv2.resize(chroma, (width, height), interpolation=cv2.INTER_LINEAR)
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB)
+
+    # Scale the chroma to full width once (it is still only a few rows
+    # tall), then interpolate the rows each strip needs, matching
+    # cv2.resize's pixel-centre alignment
+    small_rows = chroma.shape[0]
+    wide = cv2.resize(chroma, (width, small_rows), interpolation=cv2.INTER_LINEAR)
+    result = np.empty_like(orig_rgb)
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        source = np.clip((np.arange(top, bottom) + 0.5) * small_rows / height - 0.5, 0, small_rows - 1)
+        upper = source.astype(np.int32)
+        lower = np.minimum(upper + 1, small_rows - 1)
+        weight = (source - upper).astype(np.float32)[:, None, None]
+        strip_chroma = wide[upper] * (1 - weight) + wide[lower].astype(np.float32) * weight
+
+        yuv = cv2.cvtColor(orig_rgb[top:bottom], cv2.COLOR_RGB2YUV)
+        yuv[:, :, 1:3] = np.rint(strip_chroma)
+        result[top:bottom] = cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB)
+    return result
+
+
+def _predict(filtr, model_images):
+    """Run one forward pass over `model_images` (RGB arrays), splitting the batch on OOM."""
+    import torch
+    from fastai.basic_data import DatasetType
+    from fastai.vision.image import image2np
+
+    x = torch.from_numpy(np.stack(model_images)).permute(0, 3, 1, 2).float()
+    x = x.to(filtr.device)
+    x.div_(255)
+    x, y = filtr.norm((x, x), do_x=True)
+    x = precision.prepare_input(filtr, x)
+
+    try:
+        with precision.inference_context(filtr, x):
+            result = filtr.learn.pred_batch(ds_type=DatasetType.Valid, batch=(x, y), reconstruct=True)
+    except RuntimeError as rerr:
+        if 'memory' not in str(rerr) or len(model_images) == 1:
+            raise
+        half = len(model_images) // 2
+        return _predict(filtr, model_images[:half]) + _predict(filtr, model_images[half:])
+
+    outs = []
+    for out in result:
+        # Reduced-precision modes can hand back bf16 or NHWC tensors
+        out = filtr.denorm(out.px.float().contiguous(), do_x=False)
+        outs.append(image2np(out * 255).astype(np.uint8))
+    return outs
+
+
+def colorize_with(predict, images, render_sz, post_process=True, watermarked=True):
+    """Colorize RGB arrays or PIL images, running the generator through `predict`.
+
+    `predict(model_images)` maps a list of `render_sz` square model inputs
+    to the generator's colour output for each; see `colorize_batch`.
+    """
+    import cv2
+
+    with metrics.stage('preprocess'):
+        origs = [_to_rgb_array(image) for image in images]
+        model_images = [model_ready_image(orig, render_sz) for orig in origs]
+
+    with metrics.stage('inference'):
+        colors = predict(model_images)
+
+    results = []
+    with metrics.stage('postprocess'):
+        for orig, color in zip(origs, colors):
+            if post_process:
+                result = apply_chroma(color, orig)
+            else:
+                result = cv2.resize(color, (orig.shape[1], orig.shape[0]), interpolation=cv2.INTER_LINEAR)
+            if watermarked:
+                result = watermark_array(result)
+            results.append(result)
+    metrics.inc('images_colorized', len(results))
+    return results
+
+
+def colorize_batch(colorizer, images, render_factor, post_process=True, watermarked=True):
+    """Colorize several RGB arrays or PIL images with a single forward pass.
+
+    Each image is shrunk to the render_factor square, the squares are
+    stacked into one tensor for the generator, and the results are split
+    back out. With `post_process` only their chroma is scaled back up and
+    laid over each image's own full-res luminance; otherwise the raw
+    colour is stretched back to size. Returns RGB arrays.
+    """
+    # MasterFilter -> the ColorizerFilter that owns the learner
+    filtr = colorizer.filter.filters[0]
+
+    def predict(model_images):
+        colorizer._clean_mem()
+        return _predict(filtr, model_images)
+
+    return colorize_with(predict, images, render_factor * filtr.render_base, post_process=post_process,
+                         watermarked=watermarked)
+
+
+def colorize_array(colorizer, image, render_factor, post_process=True, watermarked=True):
+    """Colorize an RGB array or PIL image in memory and return an RGB array.
+
+    Same result as `colorizer.get_transformed_image`, minus the round trip
+    through an image file on disk.
+    """
+    return colorize_batch(colorizer, [image], render_factor, post_process=post_process,
+                          watermarked=watermarked)[0]
+
+
+def watermark_array(image):
+    """Apply DeOldify's watermark to an RGB array."""
+    from deoldify.visualize import get_watermarked
+    return np.asarray(get_watermarked(Image.fromarray(image)))
@@ -0,0 +1,313 @@
+"""Local inference server shared by every Chroma session on a machine.
+
+Start it next to the app and point the app at it:
+
+    python -m core.inference                                  # listens on .cache/inference.sock
+    CHROMA_INFERENCE_SERVER=.cache/inference.sock streamlit run Chroma.py
+
+With CHROMA_INFERENCE_SERVER set, core.pipeline sends each batch's
+model-ready squares to the server instead of running the generator in its
+own process. Resizing and laying the chroma over the full-resolution frame
+still happen in the caller, so only the small model inputs and outputs
+cross the socket. The server holds each request for up to BATCH_WINDOW_MS
+so requests from other sessions for the same model and size join it in one
+forward pass. Its queue is bounded: callers block while it is full and get
+ServerBusy after QUEUE_TIMEOUT seconds. Sessions no longer hold a model
+each, so raise CHROMA_JOB_WORKERS to let several jobs feed the server.
+
+If the server cannot be reached, callers fall back to in-process inference.
+"""
+import argparse
+import collections
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client as _Connect, Listener
+
+import numpy as np
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_SERVER = os.environ.get('CHROMA_INFERENCE_SERVER', '')
+DEFAULT_ADDRESS = os.path.join('.cache', 'inference.sock')
+KEY_FILE = os.environ.get('CHROMA_INFERENCE_KEY_FILE', os.path.join('.cache', 'inference.key'))
+# How long the first request of a batch waits for others to join it
+BATCH_WINDOW_MS = float(os.environ.get('CHROMA_BATCH_WINDOW_MS', '15'))
+MAX_BATCH = int(os.environ.get('CHROMA_SERVER_MAX_BATCH', '16'))
+# Images waiting for the generator before new requests are held back
+MAX_QUEUE = int(os.environ.get('CHROMA_SERVER_MAX_QUEUE', '64'))
+QUEUE_TIMEOUT = 120
+# After a failed connection, run in-process for this long before trying again
+RETRY_SECONDS = 30
+
+
+class ServerBusy(RuntimeError):
+    """The server's queue stayed full for longer than QUEUE_TIMEOUT."""
+
+
+class ServerUnavailable(ConnectionError):
+    """The server could not be reached."""
+
+
+def parse_address(spec):
+    """'host:port' for TCP, anything else is a Unix socket path."""
+    host, _, port = spec.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return spec
+
+
+def _authkey(create=False):
+    # A key shared through a private file keeps other local users off the socket
+    try:
+        with open(KEY_FILE, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        if not create:
+            raise
+    os.makedirs(os.path.dirname(KEY_FILE) or '.', exist_ok=True)
+    key = secrets.token_bytes(32)
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+class _Request:
+    def __init__(self, key, images):
+        self.key = key
+        self.images = images
+        self.arrived = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batcher:
+    """Coalesce concurrent requests with the same key into micro-batches.
+
+    `predict(key, images)` runs one forward pass and returns one output per
+    image. Requests are served oldest first; a batch collects every waiting
+    request with the oldest one's key, up to `max_batch` images, once the
+    oldest has waited `window` seconds or a full batch is waiting.
+    """
+
+    def __init__(self, predict, window=BATCH_WINDOW_MS / 1000, max_batch=MAX_BATCH, max_queue=MAX_QUEUE):
+        self.predict = predict
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.depth = 0
+        self.batches = 0
+        self.images = 0
+        self._pending = collections.deque()
+        self._changed = threading.Condition()
+
+    def submit(self, key, images, timeout=QUEUE_TIMEOUT):
+        """Queue `images` and block until their outputs are ready."""
+        request = _Request(key, images)
+        with self._changed:
+            # An oversized request is admitted on its own once the queue drains
+            if not self._changed.wait_for(lambda: not self.depth or self.depth + len(images) <= self.max_queue,
+                                          timeout):
+                raise ServerBusy(f"Inference queue full ({self.depth} images waiting)")
+            self._pending.append(request)
+            self.depth += len(images)
+            metrics.gauge('inference_queue_depth', self.depth)
+            self._changed.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self._pending)
+            first = self._pending[0]
+            deadline = first.arrived + self.window
+            while True:
+                waiting = sum(len(request.images) for request in self._pending if request.key == first.key)
+                remaining = deadline - time.perf_counter()
+                if waiting >= self.max_batch or remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+
+            batch = []
+            size = 0
+            for request in list(self._pending):
+                if request.key == first.key and (not batch or size + len(request.images) <= self.max_batch):
+                    self._pending.remove(request)
+                    batch.append(request)
+                    size += len(request.images)
+            self.depth -= size
+            metrics.gauge('inference_queue_depth', self.depth)
+            self._changed.notify_all()
+        return first.key, batch
+
+    def run(self):
+        """Serve batches forever; call on a dedicated thread."""
+        while True:
+            key, batch = self._next_batch()
+            images = [image for request in batch for image in request.images]
+            metrics.observe('inference_queue_wait', time.perf_counter() - batch[0].arrived)
+            try:
+                with metrics.stage('server_batch', kind=key[0]):
+                    outputs = self.predict(key, images)
+            except Exception as e:
+                logger.exception("Batch of %d images failed", len(images))
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            self.batches += 1
+            self.images += len(images)
+            metrics.inc('server_images', len(images))
+            start = 0
+            for request in batch:
+                request.result = outputs[start:start + len(request.images)]
+                start += len(request.images)
+                request.done.set()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth,
+            'batches': self.batches,
+            'images': self.images,
+            'mean_batch': round(self.images / self.batches, 2) if self.batches else None,
+        }
+
+
+def _predict(key, images):
+    from core import models
+    from core.colorize import _predict as predict
+
+    kind, precision, _ = key
+    with models.lease(kind, precision=precision) as colorizer:
+        colorizer._clean_mem()
+        return predict(colorizer.filter.filters[0], images)
+
+
+def _handle(conn, batcher):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            op = message.get('op')
+            if op == 'predict':
+                images = list(message['images'])
+                key = (message['kind'], message['precision'], images[0].shape)
+                try:
+                    reply = {'ok': True, 'images': np.stack(batcher.submit(key, images))}
+                except ServerBusy as e:
+                    reply = {'ok': False, 'busy': True, 'error': str(e)}
+                except Exception as e:
+                    reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            elif op == 'stats':
+                reply = {'ok': True, **batcher.stats()}
+            else:
+                reply = {'ok': False, 'error': f"Unknown request {op!r}"}
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def serve(address=DEFAULT_ADDRESS, batcher=None):
+    """Accept connections on `address` until the process is stopped."""
+    batcher = batcher or Batcher(_predict)
+    threading.Thread(target=batcher.run, daemon=True, name='chroma-batcher').start()
+    address = parse_address(address)
+    if isinstance(address, str) and os.path.exists(address):
+        # Left behind by a server that did not shut down cleanly
+        os.remove(address)
+    with Listener(address, authkey=_authkey(create=True)) as listener:
+        logger.info("Inference server listening on %s", listener.address)
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                logger.warning("Rejected connection: %s", e)
+                continue
+            threading.Thread(target=_handle, args=(conn, batcher), daemon=True).start()
+
+
+class Client:
+    """Connection to the inference server; one socket per calling thread."""
+
+    def __init__(self, address=INFERENCE_SERVER):
+        self.address = parse_address(address)
+        self._local = threading.local()
+
+    def _call(self, message):
+        conn = getattr(self._local, 'conn', None)
+        try:
+            if conn is None:
+                conn = self._local.conn = _Connect(self.address, authkey=_authkey())
+            conn.send(message)
+            reply = conn.recv()
+        except (OSError, EOFError) as e:
+            self._local.conn = None
+            raise ServerUnavailable(f"Inference server at {self.address} unreachable: {e}") from e
+        if not reply['ok']:
+            raise (ServerBusy if reply.get('busy') else RuntimeError)(reply['error'])
+        return reply
+
+    def predict(self, model_images, kind='artistic', precision='fp32'):
+        """Run the generator on model-ready squares; returns its output for each."""
+        with metrics.stage('server_roundtrip', kind=kind):
+            reply = self._call({'op': 'predict', 'kind': kind, 'precision': precision,
+                                'images': np.stack(model_images)})
+        return list(reply['images'])
+
+    def stats(self):
+        """Queue depth and batching counters of the server."""
+        return self._call({'op': 'stats'})
+
+
+_client = Client(INFERENCE_SERVER) if INFERENCE_SERVER else None
+_unavailable_until = 0.0
+
+
+def client():
+    """Return the shared Client if a server is configured and was reachable lately, else None."""
+    if _client is None or time.monotonic() < _unavailable_until:
+        return None
+    return _client
+
+
+def mark_unavailable():
+    """Run in-process for RETRY_SECONDS after the server could not be reached."""
+    global _unavailable_until
+    _unavailable_until = time.monotonic() + RETRY_SECONDS
+    logger.warning("Inference server unreachable; running inference in-process for %ds", RETRY_SECONDS)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m core.inference', description=__doc__.split('\n')[0])
+    parser.add_argument('--address', default=INFERENCE_SERVER or DEFAULT_ADDRESS,
+                        help="Unix socket path or host:port to listen on")
+    parser.add_argument('--window-ms', type=float, default=BATCH_WINDOW_MS,
+                        help="how long a request waits for others to batch with")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="images per forward pass")
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help="images queued before callers block")
+    parser.add_argument('--preload', nargs='*', default=[], metavar='KIND[:PRECISION]',
+                        help="models to load before accepting requests, e.g. artistic video:bf16")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    from core import models
+    for spec in args.preload:
+        kind, _, precision = spec.partition(':')
+        models.get_model(kind, precision=precision or 'fp32')
+    serve(args.address, Batcher(_predict, args.window_ms / 1000, args.max_batch, args.max_queue))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
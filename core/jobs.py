@@ -0,0 +1,452 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from core import metrics
+from core.resources import process_alive, process_token
+from core.scratch import ScratchFull, directory_size
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.environ.get('CHROMA_JOBS_DIR', os.path.join('.cache', 'jobs'))
+JOB_WORKERS = int(os.environ.get('CHROMA_JOB_WORKERS', '1'))
+# Videos are checkpointed after every this many seconds of footage
+SEGMENT_SECONDS = float(os.environ.get('CHROMA_SEGMENT_SECONDS', '10'))
+# Finished jobs and their files are removed after this many seconds
+JOB_TTL = 24 * 3600
+# Job directories hold a copy of each input plus its output; when they would
+# outgrow this, the oldest finished jobs are removed early
+JOBS_MAX_BYTES = int(os.environ.get('CHROMA_JOBS_MAX_MB', '8192')) * 2**20
+# How often idle workers look for new jobs and running jobs publish progress
+POLL_SECONDS = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    run_start_done INTEGER NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    trace TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    frames INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+_init_lock = threading.Lock()
+_initialised = False
+_workers = []
+
+
+class Cancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+@contextmanager
+def _db():
+    conn = sqlite3.connect(os.path.join(JOBS_DIR, 'jobs.db'), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _requeue_orphans(conn):
+    # Jobs whose process died mid-run go back on the queue; they resume
+    # from their last completed segment. Owners are process tokens, so a
+    # new process that inherits a dead one's PID (PID 1 in a restarted
+    # container) still requeues its jobs.
+    for row in conn.execute("SELECT id, owner FROM jobs WHERE status = 'running' AND owner != ?",
+                            (process_token(),)).fetchall():
+        if not process_alive(row['owner']):
+            logger.info("Requeueing job %s left running by process %s", row['id'], row['owner'])
+            conn.execute("UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ? AND owner = ?",
+                         (row['id'], row['owner']))
+
+
+def _init():
+    global _initialised
+    with _init_lock:
+        if _initialised:
+            return
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        with _db() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            # Databases from before per-job traces
+            if 'trace' not in [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]:
+                conn.execute('ALTER TABLE jobs ADD COLUMN trace TEXT')
+            # No worker of this process has started yet, so anything still
+            # running under its PID or token was left by an earlier process
+            conn.execute("UPDATE jobs SET status = 'queued', owner = NULL WHERE status = 'running' "
+                         "AND owner IN (?, ?)", (str(os.getpid()), process_token()))
+        _initialised = True
+
+
+def job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+
+class Job:
+    """Snapshot of a job's row; fetch a fresh one with `get` to see progress."""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.params = json.loads(row['params'])
+        self.status = row['status']
+        self.cancel_requested = bool(row['cancel'])
+        self.done = row['done']
+        self.total = row['total']
+        self.message = row['message']
+        self.result = row['result']
+        self.error = row['error']
+        # Per-stage timings of the latest run, see core.metrics.Trace.rows
+        self.trace = json.loads(row['trace']) if row['trace'] else []
+        self.submitted = row['submitted']
+        self.started = row['started']
+        self.finished = row['finished']
+        self._run_start_done = row['run_start_done']
+
+    @property
+    def input(self):
+        return self.params['input']
+
+    @property
+    def fraction(self):
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or self.submitted)
+
+    @property
+    def eta(self):
+        """Seconds left at the rate of the current run, or None before there is one."""
+        if self.status != 'running' or not self.total:
+            return None
+        progressed = self.done - self._run_start_done
+        if progressed <= 0:
+            return None
+        rate = progressed / (time.time() - self.started)
+        return max(0.0, (self.total - self.done) / rate)
+
+
+class _Run:
+    """Handle a job handler uses to publish progress, checkpoint and notice cancellation."""
+
+    def __init__(self, job):
+        self.job = job
+        self.dir = job_dir(job.id)
+        self._published = 0.0
+
+    def update(self, done, total=None, message=None, force=False):
+        """Record progress; raises Cancelled if the job has been cancelled meanwhile."""
+        now = time.time()
+        if not force and now - self._published < POLL_SECONDS:
+            return
+        self._published = now
+        with _db() as conn:
+            conn.execute("UPDATE jobs SET done = ?, total = COALESCE(?, total), message = COALESCE(?, message) "
+                         "WHERE id = ?", (done, total, message, self.job.id))
+            cancel = conn.execute("SELECT cancel FROM jobs WHERE id = ?", (self.job.id,)).fetchone()['cancel']
+        if cancel:
+            raise Cancelled(self.job.id)
+
+    def segments(self):
+        """Completed segments as {index: (path, frames, skipped)}, skipping files that went missing."""
+        with _db() as conn:
+            rows = conn.execute("SELECT idx, path, frames, skipped FROM segments WHERE job_id = ?",
+                                (self.job.id,)).fetchall()
+        return {row['idx']: (row['path'], row['frames'], row['skipped'])
+                for row in rows if os.path.exists(row['path'])}
+
+    def checkpoint(self, idx, path, frames, skipped):
+        with _db() as conn:
+            conn.execute("INSERT OR REPLACE INTO segments (job_id, idx, path, frames, skipped) "
+                         "VALUES (?, ?, ?, ?, ?)", (self.job.id, idx, path, frames, skipped))
+
+
+def _run_video(job, run):
+    from core.cache import results
+    from core.pipeline import colorize_video_file
+    from core.video import concat_segments, frame_count, source_fps
+
+    params = job.params
+    total = frame_count(job.input)
+    segment_frames = max(1, round(float(source_fps(job.input)) * SEGMENT_SECONDS))
+    completed = run.segments()
+    run.update(sum(frames for _, frames, _ in completed.values()), total,
+               "Resuming" if completed else "Colorizing", force=True)
+
+    paths = []
+    frames_done = 0
+    skipped = 0
+    idx = 0
+    while True:
+        segment = completed.get(idx)
+        if segment is None:
+            path = os.path.join(run.dir, f'segment{idx:05d}.mp4')
+            partial = os.path.join(run.dir, f'segment{idx:05d}.part.mp4')
+            done_before = frames_done
+            stats = colorize_video_file(job.input, partial, params['render_factor'], audio=False,
+                                        start=idx * segment_frames, count=segment_frames,
+                                        progress=lambda n: run.update(done_before + n, message="Colorizing"),
+                                        **params.get('options', {}))
+            if not stats['frames']:
+                break
+            os.replace(partial, path)
+            segment = (path, stats['frames'], stats['skipped'])
+            run.checkpoint(idx, *segment)
+        paths.append(segment[0])
+        frames_done += segment[1]
+        skipped += segment[2]
+        run.update(frames_done, message="Colorizing", force=True)
+        if segment[1] < segment_frames:
+            break
+        idx += 1
+
+    if not paths:
+        raise RuntimeError("No frames could be read from the video")
+    run.update(frames_done, frames_done, "Muxing audio", force=True)
+    output_path = os.path.join(run.dir, 'colorized.mp4')
+    concat_segments(paths, output_path, audio_path=job.input)
+    for path in paths:
+        os.remove(path)
+    summary = f"{frames_done} frames"
+    if skipped:
+        summary += f", colour reused for {skipped / frames_done:.0%} of them"
+    run.update(frames_done, message=summary, force=True)
+    cache_key = params.get('cache_key')
+    return results.put_file(cache_key, '.mp4', output_path) if cache_key else output_path
+
+
+def _run_image(job, run):
+    from core.cache import results
+    from core.pipeline import colorize_image_file
+
+    params = job.params
+    run.update(0, 1, "Colorizing", force=True)
+    output_path = os.path.join(run.dir, 'colorized.jpg')
+    colorize_image_file(job.input, output_path, params['render_factor'],
+                        watermarked=params.get('watermarked', True),
+                        precision=params.get('precision', 'fp32'))
+    run.update(1, 1, force=True)
+    cache_key = params.get('cache_key')
+    return results.put_file(cache_key, '.jpg', output_path) if cache_key else output_path
+
+
+def _run_youtube(job, run):
+    from core.cache import hash_file, results
+    from core.pipeline import video_cache_key
+    from core.youtube import colorize_url
+
+    params = job.params
+    completed = run.segments()
+    run.update(0, 0, "Resuming download" if completed else "Starting download", force=True)
+    # Frames arrive in order from a single decoder, so there is no worker pool to split them over
+    options = {name: value for name, value in params.get('options', {}).items()
+               if name not in ('workers', 'threads_per_worker')}
+    content_key = None
+
+    def downloaded(path):
+        # URLs without a video id can serve different content over time, so their results are keyed by content
+        nonlocal content_key
+        if params.get('cache_key'):
+            return None
+        content_key = video_cache_key(path, params['render_factor'], options, content_hash=hash_file(path))
+        return results.get(content_key, '.mp4')
+
+    output_path = os.path.join(run.dir, 'colorized.mp4')
+    stats = colorize_url(params['url'], job.input, output_path, params['render_factor'],
+                         highest=params.get('highest', False), segment_seconds=SEGMENT_SECONDS,
+                         completed=completed, checkpoint=run.checkpoint, downloaded=downloaded,
+                         progress=lambda done, total, message: run.update(done, total, message), **options)
+    if stats['path'] != output_path:
+        run.update(1, 1, "Same video as an earlier result", force=True)
+        return stats['path']
+    summary = f"{stats['frames']} frames"
+    if stats['skipped']:
+        summary += f", colour reused for {stats['skipped_fraction']:.0%} of them"
+    run.update(stats['frames'], stats['frames'], summary, force=True)
+    cache_key = params.get('cache_key') or content_key
+    return results.put_file(cache_key, '.mp4', output_path) if cache_key else output_path
+
+
+# Job kinds and the functions that run them: handler(job, run) -> result path
+HANDLERS = {
+    'video': _run_video,
+    'image': _run_image,
+    'youtube': _run_youtube,
+}
+
+
+def _claim():
+    with _db() as conn:
+        _requeue_orphans(conn)
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY submitted LIMIT 1").fetchone()
+        if row is None:
+            return None
+        # Another worker (or process) may have claimed it in between
+        claimed = conn.execute("UPDATE jobs SET status = 'running', owner = ?, started = ?, "
+                               "run_start_done = done WHERE id = ? AND status = 'queued'",
+                               (process_token(), time.time(), row['id'])).rowcount
+        return _fetch(conn, row['id']) if claimed else None
+
+
+def _finish(job_id, status, result=None, error=None, trace=None):
+    with _db() as conn:
+        conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, trace = ?, finished = ? WHERE id = ?",
+                     (status, result, error, json.dumps(trace.rows()) if trace else None, time.time(), job_id))
+
+
+def _execute(job):
+    run = _Run(job)
+    try:
+        with metrics.trace() as trace, metrics.stage('job', memory=True, kind=job.kind):
+            result = HANDLERS[job.kind](job, run)
+    except Cancelled:
+        logger.info("Job %s cancelled", job.id)
+        _finish(job.id, 'cancelled', trace=trace)
+        # Keep the input for display, drop the partial output
+        for name in os.listdir(run.dir):
+            if name.startswith('segment'):
+                os.remove(os.path.join(run.dir, name))
+    except Exception as e:
+        logger.exception("Job %s failed", job.id)
+        _finish(job.id, 'failed', error=str(e), trace=trace)
+    else:
+        _finish(job.id, 'done', result=result, trace=trace)
+
+
+def run_worker(stop=None):
+    """Run queued jobs one after another until `stop` (a threading.Event) is set."""
+    _init()
+    while stop is None or not stop.is_set():
+        job = _claim()
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        _execute(job)
+
+
+def start_workers(count=JOB_WORKERS):
+    """Start the background worker threads of this process, once."""
+    _init()
+    with _init_lock:
+        while len(_workers) < count:
+            thread = threading.Thread(target=run_worker, daemon=True, name=f'chroma-job-{len(_workers)}')
+            thread.start()
+            _workers.append(thread)
+
+
+def _fetch(conn, job_id):
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return Job(row) if row is not None else None
+
+
+def _prune(need=0):
+    """Remove expired jobs, then the oldest finished ones until `need` more bytes fit JOBS_MAX_BYTES.
+
+    Raises ScratchFull if queued and running jobs leave no room.
+    """
+    cutoff = time.time() - JOB_TTL
+    with _db() as conn:
+        expired = [row['id'] for row in conn.execute(
+            "SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,)).fetchall()]
+        _delete(conn, expired)
+
+        sizes = {entry.name: directory_size(entry.path) for entry in os.scandir(JOBS_DIR) if entry.is_dir()}
+        total = sum(sizes.values())
+        evicted = []
+        if total + need > JOBS_MAX_BYTES:
+            for row in conn.execute("SELECT id FROM jobs WHERE finished IS NOT NULL ORDER BY finished").fetchall():
+                if total + need <= JOBS_MAX_BYTES:
+                    break
+                evicted.append(row['id'])
+                total -= sizes.get(row['id'], 0)
+            _delete(conn, evicted)
+    if total + need > JOBS_MAX_BYTES:
+        raise ScratchFull(f"Job storage {JOBS_DIR} is full: {total / 2**20:.0f} MB held by unfinished jobs, "
+                          f"{need / 2**20:.0f} MB more requested, quota {JOBS_MAX_BYTES / 2**20:.0f} MB")
+
+
+def _delete(conn, job_ids):
+    for job_id in job_ids:
+        conn.execute("DELETE FROM segments WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def submit(kind, input_path, **params):
+    """Queue a `kind` job on a copy of `input_path`; returns the job id.
+
+    The input is copied into the job's own directory so the job can
+    resume after a restart. Jobs that fetch their own input (YouTube
+    downloads) pass None and find the path to fill in `job.input`.
+    Keyword arguments are stored as the job's parameters and must be JSON
+    serialisable. Raises ScratchFull if the job directories have no room
+    for the input and an output of about the same size.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind!r}")
+    start_workers()
+    _prune(need=2 * os.path.getsize(input_path) if input_path is not None else 0)
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id))
+    if input_path is None:
+        params['input'] = os.path.join(job_dir(job_id), 'input.mp4')
+    else:
+        params['input'] = os.path.join(job_dir(job_id), 'input' + os.path.splitext(input_path)[1])
+        shutil.copyfile(input_path, params['input'])
+    with _db() as conn:
+        conn.execute("INSERT INTO jobs (id, kind, params, status, submitted) VALUES (?, ?, ?, 'queued', ?)",
+                     (job_id, kind, json.dumps(params), time.time()))
+    return job_id
+
+
+def get(job_id):
+    """Return the current state of job `job_id`, or None if it is unknown or expired."""
+    # Make sure someone will run (or resume) it
+    start_workers()
+    with _db() as conn:
+        return _fetch(conn, job_id)
+
+
+def cancel(job_id):
+    """Cancel a queued job at once, or ask a running one to stop at its next progress update."""
+    _init()
+    with _db() as conn:
+        conn.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                     (time.time(), job_id))
+        conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+
+if __name__ == '__main__':
+    # Standalone worker: python -m core.jobs
+    logging.basicConfig(level=logging.INFO)
+    run_worker()
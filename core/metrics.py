@@ -0,0 +1,272 @@
+"""Per-stage timing and memory metrics for the Chroma pipelines.
+
+Code wraps each pipeline stage in ``with metrics.stage('decode'):``. Every
+stage feeds a process-wide histogram of its duration, plus RSS growth for
+stages opened with ``memory=True``. The registry renders as Prometheus
+text, which is exported when configured:
+
+    CHROMA_METRICS_PORT=9464     serve http://localhost:9464/metrics
+    CHROMA_METRICS_FILE=path     rewrite the file every CHROMA_METRICS_INTERVAL seconds
+
+``with metrics.trace() as t:`` additionally collects the stages run by the
+current thread into `t`, so a page can show where one request's time went.
+Worker processes keep their own registries.
+"""
+import atexit
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from core.resources import rss_bytes
+
+METRICS_PORT = int(os.environ.get('CHROMA_METRICS_PORT', '0'))
+METRICS_FILE = os.environ.get('CHROMA_METRICS_FILE')
+METRICS_INTERVAL = float(os.environ.get('CHROMA_METRICS_INTERVAL', '10'))
+
+# Histogram buckets in seconds: per-frame stages land in the first few,
+# model loads and whole jobs in the last
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+_lock = threading.Lock()
+# (stage, labels) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+# (stage, labels) -> errors raised inside the stage
+_errors = {}
+# (stage, labels) -> [total RSS growth, largest RSS growth]
+_memory = {}
+# (name, labels) -> value
+_counters = {}
+_gauges = {}
+_peak_rss = 0
+_current_trace = contextvars.ContextVar('chroma_trace', default=None)
+_exporters_started = False
+
+
+class Trace:
+    """Stages run while the trace was active, aggregated by name."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        # stage -> [count, total seconds, longest seconds, first start offset]
+        self.stages = {}
+        # Helper threads (prefetch, encoder) report into the same trace
+        self._lock = threading.Lock()
+
+    def add(self, name, start, seconds):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [1, seconds, seconds, start - self.started]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def rows(self):
+        """One dict per stage, in the order the stages first ran."""
+        with self._lock:
+            stages = dict(self.stages)
+        return [{
+            'stage': name,
+            'calls': count,
+            'total_ms': round(total * 1000, 1),
+            'max_ms': round(longest * 1000, 1),
+            'first_at_ms': round(first * 1000, 1),
+        } for name, (count, total, longest, first) in sorted(stages.items(), key=lambda kv: kv[1][3])]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Record one `seconds` long run of stage `name`."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+
+def inc(name, value=1, **labels):
+    """Add `value` to counter `name` (e.g. frames colorized)."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    """Set gauge `name` to its current `value` (e.g. a queue depth)."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+@contextmanager
+def stage(name, memory=False, **labels):
+    """Time the enclosed block as stage `name`; with `memory`, also track RSS growth."""
+    global _peak_rss
+    _start_exporters()
+    rss_before = rss_bytes() if memory else 0
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        key = _key(name, labels)
+        with _lock:
+            _errors[key] = _errors.get(key, 0) + 1
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe(name, seconds, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, start, seconds)
+        if memory:
+            rss_after = rss_bytes()
+            growth = max(0, rss_after - rss_before)
+            key = _key(name, labels)
+            with _lock:
+                entry = _memory.setdefault(key, [0, 0])
+                entry[0] += growth
+                entry[1] = max(entry[1], growth)
+                _peak_rss = max(_peak_rss, rss_after)
+
+
+@contextmanager
+def trace():
+    """Collect the stages this thread runs inside the block into a Trace."""
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        current.finished = time.perf_counter()
+        _current_trace.reset(token)
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render_prometheus():
+    """Return every metric in the Prometheus text exposition format."""
+    global _peak_rss
+    rss = rss_bytes()
+    with _lock:
+        _peak_rss = max(_peak_rss, rss)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+        errors = dict(_errors)
+        memory = {key: list(value) for key, value in _memory.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        peak_rss = _peak_rss
+
+    lines = ['# HELP chroma_stage_seconds Time spent in each pipeline stage.',
+             '# TYPE chroma_stage_seconds histogram']
+    for (name, labels), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram[:-1]):
+            cumulative += count
+            lines.append(f'chroma_stage_seconds_bucket{_labels(labels, stage=name, le=bound)} {cumulative}')
+        lines.append(f'chroma_stage_seconds_sum{_labels(labels, stage=name)} {histogram[-1]:.6f}')
+        lines.append(f'chroma_stage_seconds_count{_labels(labels, stage=name)} {cumulative}')
+
+    lines += ['# HELP chroma_stage_errors_total Stage runs that raised.',
+              '# TYPE chroma_stage_errors_total counter']
+    lines += [f'chroma_stage_errors_total{_labels(labels, stage=name)} {count}'
+              for (name, labels), count in sorted(errors.items())]
+
+    lines += ['# HELP chroma_stage_rss_growth_bytes_total Resident memory gained during a stage, summed over runs.',
+              '# TYPE chroma_stage_rss_growth_bytes_total counter']
+    lines += [f'chroma_stage_rss_growth_bytes_total{_labels(labels, stage=name)} {total}'
+              for (name, labels), (total, _) in sorted(memory.items())]
+    lines += ['# HELP chroma_stage_rss_growth_bytes_max Largest resident memory gain in a single run of a stage.',
+              '# TYPE chroma_stage_rss_growth_bytes_max gauge']
+    lines += [f'chroma_stage_rss_growth_bytes_max{_labels(labels, stage=name)} {largest}'
+              for (name, labels), (_, largest) in sorted(memory.items())]
+
+    for (name, labels), value in sorted(counters.items()):
+        lines += [f'# TYPE chroma_{name}_total counter', f'chroma_{name}_total{_labels(labels)} {value}']
+    for (name, labels), value in sorted(gauges.items()):
+        lines += [f'# TYPE chroma_{name} gauge', f'chroma_{name}{_labels(labels)} {value}']
+
+    lines += ['# HELP chroma_process_rss_bytes Resident memory of this process.',
+              '# TYPE chroma_process_rss_bytes gauge', f'chroma_process_rss_bytes {rss}',
+              '# HELP chroma_process_peak_rss_bytes Highest resident memory seen by the metrics.',
+              '# TYPE chroma_process_peak_rss_bytes gauge', f'chroma_process_peak_rss_bytes {peak_rss}']
+    return '\n'.join(lines) + '\n'
+
+
+def write(path):
+    """Write the Prometheus text to `path` atomically."""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+def _serve(port):
+    import logging
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    except OSError as e:
+        # Another Chroma process (e.g. a batch run) already serves this port
+        logging.getLogger(__name__).warning("Not serving metrics on port %d: %s", port, e)
+        return
+    server.serve_forever()
+
+
+def _write_periodically(path, interval):
+    while True:
+        time.sleep(interval)
+        write(path)
+
+
+def _start_exporters():
+    global _exporters_started
+    if _exporters_started:
+        return
+    with _lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if METRICS_PORT:
+        threading.Thread(target=_serve, args=(METRICS_PORT,), daemon=True, name='chroma-metrics-http').start()
+    if METRICS_FILE:
+        atexit.register(write, METRICS_FILE)
+        threading.Thread(target=_write_periodically, args=(METRICS_FILE, METRICS_INTERVAL), daemon=True,
+                         name='chroma-metrics-file').start()
+
+
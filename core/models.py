@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from core import metrics, precision as precisions
+from core.resources import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+# Colorizer kinds and the generator weights in models/ each one loads
+WEIGHTS = {
+    'artistic': 'ColorizeArtistic_gen',
+    'video': 'ColorizeVideo_gen',
+}
+
+# Other shared models; these fetch their own checkpoints. VoiceFixer's mode 2
+# switches the model to train mode, so it gets an instance of its own
+OTHER_MODELS = ('voicefixer', 'voicefixer_train')
+
+
+class _Entry:
+    """A loaded model plus the lock that serialises its use."""
+
+    def __init__(self, kind, device, precision, model, load_seconds, rss_delta):
+        self.kind = kind
+        self.device = device
+        self.precision = precision
+        self.model = model
+        self.load_seconds = load_seconds
+        self.rss_delta = rss_delta
+        self.lock = threading.Lock()
+        self.leases = 0
+
+
+_entries = {}
+_entries_lock = threading.Lock()
+_load_locks = {}
+_default_device = None
+
+
+def default_device():
+    """Return the device used when none is given: 'gpu0' when CUDA is available, else 'cpu'."""
+    if _default_device is not None:
+        return _default_device
+    import torch
+    return 'gpu0' if torch.cuda.is_available() else 'cpu'
+
+
+def set_default_device(device):
+    """Pin the device used when none is given (None restores auto-detection)."""
+    global _default_device
+    _default_device = device
+
+
+def _load(kind, device_name):
+    if kind in OTHER_MODELS:
+        from voicefixer import VoiceFixer
+        return VoiceFixer()
+
+    from deoldify import device
+    from deoldify.device_id import DeviceId
+    from deoldify.visualize import get_artistic_image_colorizer, get_stable_video_colorizer
+
+    # Must happen before the learner is built so the filter picks the device
+    device.set(device=DeviceId.CPU if device_name == 'cpu' else DeviceId.GPU0)
+
+    if kind == 'artistic':
+        return get_artistic_image_colorizer(weights_name=WEIGHTS[kind])
+    # The video colorizer wraps an image visualizer; keep just that so every
+    # kind hands out the same interface
+    return get_stable_video_colorizer(weights_name=WEIGHTS[kind]).vis
+
+
+def _get_entry(kind, device_name, precision='fp32'):
+    if kind not in WEIGHTS and kind not in OTHER_MODELS:
+        raise ValueError(f"Unknown model kind: {kind!r}")
+    precisions.check(precision)
+    if kind in OTHER_MODELS and precision != 'fp32':
+        raise ValueError(f"{kind} only runs in fp32")
+    key = (kind, device_name or default_device(), precision)
+
+    with _entries_lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            return entry
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Load outside the registry lock so different models can load in
+    # parallel, but never load the same model twice
+    with load_lock:
+        with _entries_lock:
+            entry = _entries.get(key)
+        if entry is not None:
+            return entry
+
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        with metrics.stage('model_load', memory=True, kind=kind, precision=precision):
+            model = _load(kind, key[1])
+            if kind in WEIGHTS:
+                model = precisions.apply(model, precision)
+        load_seconds = time.perf_counter() - start
+        rss_delta = rss_bytes() - rss_before
+
+        entry = _Entry(kind, key[1], precision, model, load_seconds, rss_delta)
+        logger.info("Loaded %s model on %s (%s) in %.2fs (+%.1f MB RSS)",
+                    kind, key[1], precision, load_seconds, rss_delta / 2**20)
+        with _entries_lock:
+            _entries[key] = entry
+        return entry
+
+
+def get_model(kind, device=None, precision='fp32'):
+    """Return the shared model for `kind`, loading it on first use.
+
+    Each `precision` (see core.precision) is a separate model instance.
+    """
+    return _get_entry(kind, device, precision).model
+
+
+def get_colorizer(kind='artistic', device=None, precision='fp32'):
+    """Return the shared colorizer for `kind`, loading it on first use.
+
+    Prefer `lease` when running inference: the visualizer is not safe to
+    call from several threads at once.
+    """
+    return get_model(kind, device, precision)
+
+
+@contextmanager
+def lease(kind='artistic', device=None, precision='fp32'):
+    """Borrow the shared model for `kind` with exclusive use."""
+    entry = _get_entry(kind, device, precision)
+    with entry.lock:
+        entry.leases += 1
+        yield entry.model
+
+
+def stats():
+    """Return load time, memory and lease counts for every loaded model."""
+    with _entries_lock:
+        entries = list(_entries.values())
+    return {
+        'process_rss_mb': round(rss_bytes() / 2**20, 1),
+        'models': [{
+            'kind': entry.kind,
+            'device': entry.device,
+            'precision': entry.precision,
+            'load_seconds': round(entry.load_seconds, 3),
+            'rss_delta_mb': round(entry.rss_delta / 2**20, 1),
+            'leases': entry.leases,
+            'in_use': entry.lock.locked(),
+        } for entry in entries],
+    }
@@ -0,0 +1,158 @@
+import atexit
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from core.video import FrameWriter, batched, read_frames, source_fps
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _init_worker(kind, threads, precision='fp32'):
+    # Runs once in each worker: cap intra-op threads so workers don't
+    # oversubscribe the cores, then load this worker's model copy
+    import torch
+    torch.set_num_threads(threads)
+
+    from core import models
+    models.get_model(kind, 'cpu', precision)
+    # Later leases in this worker must resolve to the same CPU model
+    models.set_default_device('cpu')
+
+
+def _colorize_segment(video_path, kind, start, count, render_factor, batch_size, post_process,
+                      frame_options):
+    from core.pipeline import make_frame_colorizer
+
+    # Temporal reuse restarts at every segment: its first frame is always a keyframe
+    colorize, reuse = make_frame_colorizer(render_factor, kind, post_process, **frame_options)
+    results = []
+    for frames in batched(read_frames(video_path, start=start, count=count), batch_size):
+        results.extend(colorize(frames))
+    return results, (reuse.skipped if reuse else 0)
+
+
+def default_workers(threads_per_worker=1):
+    return max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+
+def get_pool(kind='artistic', workers=None, threads_per_worker=1, precision='fp32'):
+    """Return the shared worker pool for this configuration, starting it if needed.
+
+    Pools live for the whole process so each worker loads its model once,
+    not once per video.
+    """
+    workers = workers or default_workers(threads_per_worker)
+    key = (kind, workers, threads_per_worker, precision)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            # spawn rather than fork: forking after torch has started its
+            # OpenMP threads can deadlock the children
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(kind, threads_per_worker, precision))
+            _pools[key] = pool
+        return pool
+
+
+def map_ordered(pool, fn, argsets, inflight):
+    """Yield `fn(*args)` for each of `argsets`, in order, computed on `pool`.
+
+    Unlike `pool.map` the inputs are consumed lazily, with at most
+    `inflight` calls outstanding, so large inputs never pile up in memory.
+    """
+    argsets = iter(argsets)
+    pending = collections.deque()
+    try:
+        for args in itertools.islice(argsets, inflight):
+            pending.append(pool.submit(fn, *args))
+        while pending:
+            result = pending.popleft().result()
+            for args in itertools.islice(argsets, 1):
+                pending.append(pool.submit(fn, *args))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@atexit.register
+def shutdown_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+def colorize_to_file_parallel(video_path, output_path, render_factor, kind='artistic', workers=None,
+                              threads_per_worker=1, segment_frames=24, batch_size=4,
+                              post_process=True, reuse_threshold=0.0, max_reuse=12, flow=False,
+                              precision='fp32', fps=None, start=0, count=None, progress=None, **encoder_options):
+    """Colorize `video_path` across a pool of CPU worker processes.
+
+    The video is cut into fixed-length segments of `segment_frames` frames.
+    Each worker decodes and colorizes whole segments with its own model
+    copy, and the results are written to `output_path` in frame order.
+    At most two segments per worker are in flight, which bounds memory.
+    The output keeps the source frame rate unless `fps` is given.
+    `start`, `count` and `progress` work as for `colorize_to_file`, and
+    `encoder_options` go to FrameWriter.
+    Returns the number of frames written and how many of them reused a
+    keyframe's chroma instead of running the generator.
+    """
+    workers = workers or default_workers(threads_per_worker)
+    pool = get_pool(kind, workers, threads_per_worker, precision)
+    frame_options = {'reuse_threshold': reuse_threshold, 'max_reuse': max_reuse, 'flow': flow,
+                     'precision': precision}
+    end = None if count is None else start + count
+    pending = collections.deque()
+    next_start = start
+    skipped = 0
+
+    def submit():
+        nonlocal next_start
+        frames = segment_frames if end is None else min(segment_frames, end - next_start)
+        if frames <= 0:
+            return
+        pending.append((pool.submit(_colorize_segment, video_path, kind, next_start, frames,
+                                    render_factor, batch_size, post_process, frame_options), frames))
+        next_start += frames
+
+    fps = fps or source_fps(video_path)
+    started = time.perf_counter()
+    with FrameWriter(output_path, fps=fps, **encoder_options) as writer:
+        try:
+            for _ in range(workers * 2):
+                submit()
+            colorized_frames = 0
+            while pending:
+                future, requested = pending.popleft()
+                frames, segment_skipped = future.result()
+                skipped += segment_skipped
+                for frame in frames:
+                    writer.write(frame)
+                colorized_frames += len(frames)
+                if progress is not None:
+                    progress(colorized_frames)
+                if len(frames) < requested:
+                    # Short segment: end of the video
+                    break
+                submit()
+        finally:
+            # Drop speculative segments past the end (or everything on error)
+            for future, _ in pending:
+                future.cancel()
+    elapsed = time.perf_counter() - started
+    logger.info("Colorized %d frames on %d workers in %.1fs (%.2f fps)", writer.frames_written,
+                workers, elapsed, writer.frames_written / elapsed if elapsed else 0.0)
+    return writer.frames_written, skipped
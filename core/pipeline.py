@@ -0,0 +1,170 @@
+import logging
+
+from core import inference, models
+from core.colorize import (RENDER_BASE, auto_batch_size, check_image_size, colorize_batch, colorize_with,
+                           watermark_array)
+from core.video import ENCODER_PRESET, ENCODER_THREADS, colorize_to_file
+
+logger = logging.getLogger(__name__)
+
+# colorize_video_file options that change the output; the rest only affect speed
+OUTPUT_OPTIONS = ('reuse_threshold', 'max_reuse', 'flow')
+
+
+def colorize_images(images, render_factor, kind='artistic', post_process=True, watermarked=True,
+                    precision='fp32'):
+    """Colorize RGB arrays or PIL images; returns RGB arrays.
+
+    The generator runs on the inference server when one is configured (see
+    core.inference), otherwise on this process's shared model.
+    """
+    remote = inference.client()
+    if remote is not None:
+        try:
+            return colorize_with(lambda model_images: remote.predict(model_images, kind, precision), images,
+                                 render_factor * RENDER_BASE, post_process=post_process, watermarked=watermarked)
+        except inference.ServerUnavailable:
+            inference.mark_unavailable()
+    with models.lease(kind, precision=precision) as colorizer:
+        return colorize_batch(colorizer, images, render_factor=render_factor,
+                              post_process=post_process, watermarked=watermarked)
+
+
+def colorize_frames(frames, render_factor, kind='artistic', post_process=True, watermarked=True,
+                    precision='fp32'):
+    """Colorize a batch of BGR frames; returns RGB arrays."""
+    import cv2
+
+    # OpenCV decodes to BGR, DeOldify expects RGB
+    frames_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    return colorize_images(frames_rgb, render_factor, kind, post_process, watermarked, precision)
+
+
+def make_frame_colorizer(render_factor, kind='artistic', post_process=True, reuse_threshold=0.0,
+                         max_reuse=12, flow=False, precision='fp32'):
+    """Build the batch callable used by the video pipelines.
+
+    Returns `(colorize, reuse)`: `colorize` maps a list of BGR frames to RGB
+    arrays and `reuse` is the TemporalReuse tracking skipped frames, or
+    None when temporal reuse is off (`reuse_threshold` of 0).
+    """
+    if not reuse_threshold:
+        return (lambda frames: colorize_frames(frames, render_factor, kind, post_process,
+                                               precision=precision)), None
+
+    from core.temporal import TemporalReuse
+
+    # Keyframes are colorized without the watermark so reused frames only
+    # borrow real chroma; every output frame is watermarked afterwards
+    reuse = TemporalReuse(lambda frames: colorize_frames(frames, render_factor, kind, post_process,
+                                                         watermarked=False, precision=precision),
+                          threshold=reuse_threshold, max_reuse=max_reuse, flow=flow)
+    return (lambda frames: [watermark_array(frame) for frame in reuse(frames)]), reuse
+
+
+def _precision_setting(precision):
+    # fp32 keys stay as they were before reduced precision existed
+    return {} if precision == 'fp32' else {'precision': precision}
+
+
+def image_cache_key(image_bytes, render_factor, watermarked=True, kind='artistic', precision='fp32'):
+    """Result-cache key for colorizing an image with these settings."""
+    from core.cache import ResultCache, hash_bytes
+    return ResultCache.key(hash_bytes(image_bytes), model=kind, render_factor=render_factor,
+                           watermarked=watermarked, post_process=True, **_precision_setting(precision))
+
+
+def colorize_image_file(image_path, output_path, render_factor, watermarked=True, kind='artistic',
+                        precision='fp32'):
+    """Colorize the image at `image_path` and save it as a JPEG."""
+    from PIL import Image
+
+    image = Image.open(image_path)
+    check_image_size(*image.size)
+    image = image.convert('RGB')
+    colorized = colorize_images([image], render_factor, kind, watermarked=watermarked, precision=precision)[0]
+    Image.fromarray(colorized).save(output_path, format='JPEG')
+    return output_path
+
+
+def _video_settings(options):
+    options = options or {}
+    settings = {name: options.get(name) for name in OUTPUT_OPTIONS} if options.get('reuse_threshold') else {}
+    settings.update(_precision_setting(options.get('precision', 'fp32')))
+    return settings
+
+
+def video_cache_key(video_path, render_factor, options=None, kind='artistic', content_hash=None):
+    """Result-cache key for colorizing `video_path` with these settings.
+
+    Pass the file's `content_hash` when it is already known to skip hashing it.
+    """
+    from core.cache import ResultCache, hash_file
+    return ResultCache.key(content_hash or hash_file(video_path), model=kind, render_factor=render_factor,
+                           watermarked=True, post_process=True, **_video_settings(options))
+
+
+def youtube_cache_key(url, render_factor, options=None, highest=False, kind='artistic'):
+    """Result-cache key for colorizing the YouTube video at `url`, known before downloading it.
+
+    Keyed by video id, so every form of a link to the same video shares
+    results. Returns None for other URLs: what they serve can change, so
+    their results are keyed by content once downloaded (see video_cache_key).
+    """
+    from core.cache import ResultCache
+    from core.youtube import video_id
+    youtube_id = video_id(url)
+    if youtube_id is None:
+        return None
+    return ResultCache.key(f'youtube:{youtube_id}', model=kind, render_factor=render_factor,
+                           watermarked=True, post_process=True, highest=highest, **_video_settings(options))
+
+
+def colorize_video_file(video_path, output_path, render_factor, kind='artistic', batch_size=0,
+                        workers=0, threads_per_worker=1, post_process=True, reuse_threshold=0.0,
+                        max_reuse=12, flow=False, audio=True, preset=ENCODER_PRESET,
+                        encoder_threads=ENCODER_THREADS, start=0, count=None, progress=None,
+                        precision='fp32'):
+    """Colorize `video_path` into an H.264 mp4 at `output_path`.
+
+    Runs in this process by default, or on a pool of `workers` CPU
+    processes when `workers` is set. A `batch_size` of 0 sizes batches to
+    the available RAM. A non-zero `reuse_threshold` enables temporal reuse
+    (see core.temporal). With `audio` the source's soundtrack is copied
+    into the output by the same ffmpeg process that encodes the frames;
+    `preset` and `encoder_threads` configure the x264 encoder. `start`,
+    `count` and `progress` restrict the run to a frame range and report
+    frames colorized so far (see core.video.colorize_to_file). `precision`
+    picks the generator's inference mode (see core.precision). Returns a
+    dict with the number of frames written and how many (and what
+    fraction) skipped the generator.
+    """
+    frame_options = {'reuse_threshold': reuse_threshold, 'max_reuse': max_reuse, 'flow': flow,
+                     'precision': precision}
+    encoder_options = {
+        'audio_path': video_path if audio else None,
+        'preset': preset,
+        'threads': encoder_threads,
+    }
+    range_options = {'start': start, 'count': count, 'progress': progress}
+
+    if workers:
+        from core.parallel import colorize_to_file_parallel
+
+        # Every worker runs its own batches, so split the memory budget
+        batch_size = batch_size or auto_batch_size(render_factor, memory_fraction=0.5 / workers)
+        frames, skipped = colorize_to_file_parallel(video_path, output_path, render_factor, kind=kind,
+                                                    workers=workers, threads_per_worker=threads_per_worker,
+                                                    batch_size=batch_size, post_process=post_process,
+                                                    **frame_options, **range_options, **encoder_options)
+    else:
+        batch_size = batch_size or auto_batch_size(render_factor)
+        colorize, reuse = make_frame_colorizer(render_factor, kind, post_process, **frame_options)
+        frames = colorize_to_file(video_path, output_path, colorize, batch_size=batch_size,
+                                  **range_options, **encoder_options)
+        skipped = reuse.skipped if reuse else 0
+
+    stats = {'frames': frames, 'skipped': skipped, 'skipped_fraction': skipped / frames if frames else 0.0}
+    if reuse_threshold:
+        logger.info("Temporal reuse skipped %.1f%% of %d frames", 100 * stats['skipped_fraction'], frames)
+    return stats
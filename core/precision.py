@@ -0,0 +1,89 @@
+"""Reduced-precision inference modes for the DeOldify generators.
+
+'fp32' is DeOldify's own inference. The other modes trade a little
+accuracy for CPU speed; benchmarks/precision.py measures both against fp32
+on the sample media:
+
+    bf16           run the generator under autocast in bfloat16
+    channels_last  NHWC weights and inputs, the layout oneDNN convolutions prefer
+    traced         a frozen TorchScript graph per input shape, still in fp32
+
+Dynamic int8 quantization is not offered: torch only quantizes Linear and
+recurrent layers dynamically, and the generators are convolutional.
+"""
+import collections
+import os
+from contextlib import nullcontext
+
+PRECISIONS = ('fp32', 'bf16', 'channels_last', 'traced')
+DEFAULT_PRECISION = os.environ.get('CHROMA_PRECISION', 'fp32')
+
+# Traced graphs kept per model; each render factor and batch size needs its own
+MAX_GRAPHS = 4
+
+
+def check(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision!r} (expected one of {', '.join(PRECISIONS)})")
+    return precision
+
+
+def _traced(model):
+    import torch
+
+    class Traced(torch.nn.Module):
+        """Run `model` through a frozen trace of it, traced on first use of each input shape.
+
+        The U-Net's upsampling path bakes tensor sizes into a trace, so one
+        graph cannot serve every render factor.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.model = model
+            self.graphs = collections.OrderedDict()
+
+        def forward(self, x):
+            key = tuple(x.shape)
+            graph = self.graphs.get(key)
+            if graph is None:
+                with torch.no_grad():
+                    graph = torch.jit.freeze(torch.jit.trace(self.model.eval(), x, check_trace=False))
+                self.graphs[key] = graph
+                while len(self.graphs) > MAX_GRAPHS:
+                    self.graphs.popitem(last=False)
+            else:
+                self.graphs.move_to_end(key)
+            return graph(x)
+
+    return Traced()
+
+
+def apply(colorizer, precision):
+    """Convert a freshly loaded colorizer's generator for `precision`, in place."""
+    check(precision)
+    # MasterFilter -> the ColorizerFilter that owns the learner
+    filtr = colorizer.filter.filters[0]
+    filtr.precision = precision
+    if precision == 'channels_last':
+        import torch
+        filtr.learn.model = filtr.learn.model.to(memory_format=torch.channels_last)
+    elif precision == 'traced':
+        filtr.learn.model = _traced(filtr.learn.model)
+    return colorizer
+
+
+def prepare_input(filtr, x):
+    """Lay out the normalised input batch `x` the way the generator expects."""
+    if getattr(filtr, 'precision', 'fp32') == 'channels_last':
+        import torch
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
+
+
+def inference_context(filtr, x):
+    """Context to run the generator's forward pass on `x` in."""
+    if getattr(filtr, 'precision', 'fp32') == 'bf16':
+        import torch
+        return torch.autocast(x.device.type, dtype=torch.bfloat16)
+    return nullcontext()
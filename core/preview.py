@@ -0,0 +1,65 @@
+"""Quick low-resolution previews of a video's colorization.
+
+A preview colorizes a few frames shrunk to PREVIEW_HEIGHT, either spread
+evenly over the whole video or the first seconds at a reduced frame rate,
+so a render factor can be judged in seconds before the full job runs.
+"""
+from core.pipeline import colorize_frames
+from core.video import FrameWriter, batched, frame_count, read_frames, source_fps
+
+PREVIEW_HEIGHT = 360
+PREVIEW_FRAMES = 6
+PREVIEW_SECONDS = 3
+# Frame rate of first-seconds preview clips
+PREVIEW_FPS = 8
+
+
+def _shrink(frame, height):
+    import cv2
+    if frame.shape[0] <= height:
+        return frame
+    width = max(2, round(frame.shape[1] * height / frame.shape[0]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def sample_frames(video_path, count=PREVIEW_FRAMES):
+    """Return `(frame index, BGR frame)` for `count` frames spread evenly over the video."""
+    total = frame_count(video_path)
+    if not total:
+        return list(enumerate(read_frames(video_path, count=count)))
+    indexes = sorted({round((i + 0.5) * total / count) for i in range(count)} - {total})
+    samples = []
+    for index in indexes:
+        for frame in read_frames(video_path, start=index, count=1):
+            samples.append((index, frame))
+    return samples
+
+
+def preview_frames(video_path, render_factor, kind='artistic', count=PREVIEW_FRAMES, height=PREVIEW_HEIGHT,
+                   precision='fp32'):
+    """Colorize a sparse sample of frames at low resolution; returns `(seconds, RGB array)` pairs."""
+    fps = float(source_fps(video_path))
+    samples = sample_frames(video_path, count)
+    colorized = colorize_frames([_shrink(frame, height) for _, frame in samples], render_factor, kind,
+                                precision=precision)
+    return [(index / fps, image) for (index, _), image in zip(samples, colorized)]
+
+
+def preview_clip(video_path, output_path, render_factor, kind='artistic', seconds=PREVIEW_SECONDS,
+                 height=PREVIEW_HEIGHT, fps=PREVIEW_FPS, precision='fp32', batch_size=4):
+    """Colorize the first `seconds` of the video at low resolution and `fps` into a silent mp4.
+
+    Returns the number of frames written.
+    """
+    source = float(source_fps(video_path))
+    step = max(1, round(source / fps))
+    frames = (_shrink(frame, height)
+              for index, frame in enumerate(read_frames(video_path, count=round(source * seconds)))
+              if index % step == 0)
+    written = 0
+    with FrameWriter(output_path, fps=source / step, preset='ultrafast') as writer:
+        for batch in batched(frames, batch_size):
+            for image in colorize_frames(batch, render_factor, kind, precision=precision):
+                writer.write(image)
+                written += 1
+    return written
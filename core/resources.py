@@ -0,0 +1,79 @@
+import os
+import sys
+
+
+def rss_bytes():
+    """Return the current resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    # No procfs (macOS): fall back to the peak RSS, which getrusage reports
+    # in bytes on macOS and kilobytes elsewhere
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def available_memory():
+    """Return the bytes of RAM available for new allocations, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+
+def _proc_stat(pid):
+    # Fields of /proc/<pid>/stat after the command name, or None without procfs
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+
+def process_token(pid=None):
+    """Name process `pid` (default this one) so that a later process reusing its PID differs.
+
+    The token is 'pid_start', with the process start time from procfs, or
+    just the PID where that is unavailable. A restarted container's PID 1
+    gets the same PID but a new token.
+    """
+    pid = os.getpid() if pid is None else pid
+    fields = _proc_stat(pid)
+    return f'{pid}_{fields[19]}' if fields and len(fields) > 19 else str(pid)
+
+
+def process_alive(token):
+    """Return whether the process named by `token` (a PID or process_token) is running.
+
+    Zombies count as dead, and so does a PID now held by a newer process.
+    """
+    pid, _, started = str(token).partition('_')
+    pid = int(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    fields = _proc_stat(pid)
+    if not fields:
+        return True
+    # A killed worker nobody has reaped yet lingers as a zombie
+    return fields[0] != 'Z' and (not started or fields[19:20] == [started])
@@ -0,0 +1,229 @@
+"""Scratch directories for uploads, downloads and intermediate files.
+
+Every user of scratch space gets its own directory, so concurrent sessions
+never share file names:
+
+    with scratch.workspace('upload', size_hint=len(data)) as ws:
+        path = ws.file('input.jpg')
+
+Directories are named after the process that created them, by PID and
+start time so a PID reused after a crash is not mistaken for the owner. A
+workspace is removed when its `with` block ends or the process exits; the
+sweep that runs before new workspaces are created also removes the
+leftovers of crashed processes, workspaces idle for longer than
+SCRATCH_TTL, and, when the disk quota is exceeded, the least recently used
+idle workspaces. Long writes hold a lease (`with ws.busy():`) so their
+workspace is never swept, however long they run. Workspaces whose expected
+size is small go to a RAM-backed tmpfs (/dev/shm) when one is available.
+"""
+import atexit
+import contextlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from core.resources import process_alive, process_token
+
+SCRATCH_DIR = os.environ.get('CHROMA_SCRATCH_DIR', os.path.join('.cache', 'scratch'))
+SCRATCH_MAX_BYTES = int(os.environ.get('CHROMA_SCRATCH_MAX_MB', '4096')) * 2**20
+# RAM-backed scratch; set CHROMA_SCRATCH_RAM_DIR to an empty string to disable it
+RAM_DIR = os.environ.get('CHROMA_SCRATCH_RAM_DIR',
+                         os.path.join('/dev/shm', 'chroma-scratch') if os.path.isdir('/dev/shm') else '')
+RAM_MAX_BYTES = int(os.environ.get('CHROMA_SCRATCH_RAM_MAX_MB', '512')) * 2**20
+# Workspaces expected to stay below this go to RAM
+RAM_WORKSPACE_BYTES = int(os.environ.get('CHROMA_SCRATCH_RAM_WORKSPACE_MB', '64')) * 2**20
+# Idle workspaces (e.g. of closed browser sessions) are removed after this many seconds
+SCRATCH_TTL = 2 * 3600
+# Workspaces used this recently are never evicted to make room
+IN_USE_SECONDS = 60
+SWEEP_SECONDS = 60
+# Present in a workspace while a lease is held on it
+BUSY_FILE = '.busy'
+
+
+class ScratchFull(OSError):
+    """Raised when a workspace does not fit the quota even after eviction."""
+
+
+def directory_size(path):
+    """Total size of the files under `path`."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class Workspace:
+    """One private scratch directory; a context manager that removes it on exit."""
+
+    def __init__(self, space, path):
+        self.space = space
+        self.path = path
+        self._leases = 0
+
+    def file(self, name):
+        """Path for `name` inside the workspace; marks the workspace as in use."""
+        self.touch()
+        return os.path.join(self.path, name)
+
+    def touch(self):
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def busy(self):
+        """Keep the sweep away from this workspace while the block runs.
+
+        Writing to a file does not change the directory's mtime, so anything
+        that writes into the workspace for longer than IN_USE_SECONDS should
+        hold a lease.
+        """
+        marker = os.path.join(self.path, BUSY_FILE)
+        with self.space._lock:
+            if not self._leases:
+                open(marker, 'w').close()
+            self._leases += 1
+        try:
+            yield self
+        finally:
+            with self.space._lock:
+                self._leases -= 1
+                if not self._leases:
+                    try:
+                        os.remove(marker)
+                    except FileNotFoundError:
+                        pass
+            self.touch()
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.space._forget(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScratchSpace:
+    """Workspaces under `root`, together capped at `max_bytes`."""
+
+    def __init__(self, root=SCRATCH_DIR, max_bytes=SCRATCH_MAX_BYTES, ttl=SCRATCH_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._open = set()
+        self._last_sweep = 0.0
+
+    def create(self, prefix='job', size_hint=0):
+        """Make a new workspace, first freeing room for `size_hint` bytes."""
+        os.makedirs(self.root, exist_ok=True)
+        if size_hint or time.time() - self._last_sweep > SWEEP_SECONDS:
+            self.sweep(need=size_hint)
+        path = os.path.join(self.root, f'{prefix}-{process_token()}-{uuid.uuid4().hex[:12]}')
+        os.makedirs(path)
+        workspace = Workspace(self, path)
+        with self._lock:
+            self._open.add(workspace)
+        return workspace
+
+    def _forget(self, workspace):
+        with self._lock:
+            self._open.discard(workspace)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            try:
+                # Owner is a process_token, or a bare PID for older directories
+                owner = entry.name.rsplit('-', 2)[1]
+                int(owner.partition('_')[0])
+                mtime = entry.stat().st_mtime
+            except (IndexError, ValueError, FileNotFoundError):
+                continue
+            entries.append((mtime, owner, entry.path))
+        return entries
+
+    def sweep(self, need=0):
+        """Remove orphaned and expired workspaces, then evict idle ones until `need` bytes fit.
+
+        Raises ScratchFull if the workspaces in use leave no room for `need`.
+        """
+        with self._lock:
+            self._last_sweep = time.time()
+            if not os.path.isdir(self.root):
+                return
+            now = time.time()
+            live = []
+            for mtime, owner, path in self._entries():
+                alive = process_alive(owner)
+                busy = alive and os.path.exists(os.path.join(path, BUSY_FILE))
+                if not alive or (now - mtime > self.ttl and not busy):
+                    # Left behind by a crashed process, or abandoned
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    live.append((mtime, busy, path, directory_size(path)))
+            total = sum(size for _, _, _, size in live)
+            for mtime, busy, path, size in sorted(live):
+                if total + need <= self.max_bytes:
+                    break
+                if busy or now - mtime < IN_USE_SECONDS:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            if total + need > self.max_bytes:
+                raise ScratchFull(f"Scratch space {self.root} is full: {total / 2**20:.0f} MB in use, "
+                                  f"{need / 2**20:.0f} MB more requested, quota {self.max_bytes / 2**20:.0f} MB")
+
+    def usage(self):
+        if not os.path.isdir(self.root):
+            return 0
+        return sum(directory_size(path) for _, _, path in self._entries())
+
+    def close_all(self):
+        """Remove every workspace this process still has open."""
+        with self._lock:
+            workspaces = list(self._open)
+        for workspace in workspaces:
+            workspace.close()
+
+
+disk = ScratchSpace()
+ram = ScratchSpace(RAM_DIR, RAM_MAX_BYTES) if RAM_DIR else None
+
+
+def fits_ram(size_hint):
+    """Whether `size_hint` bytes are known and small enough for RAM-backed scratch."""
+    return ram is not None and 0 < size_hint <= RAM_WORKSPACE_BYTES
+
+
+def workspace(prefix='job', size_hint=0):
+    """Create a workspace, in RAM when `size_hint` is known and small, otherwise on disk."""
+    if fits_ram(size_hint):
+        try:
+            return ram.create(prefix, size_hint)
+        except (ScratchFull, OSError):
+            pass
+    return disk.create(prefix, size_hint)
+
+
+@atexit.register
+def _close_all():
+    disk.close_all()
+    if ram is not None:
+        ram.close_all()
@@ -0,0 +1,81 @@
+import collections
+import hashlib
+import threading
+
+import numpy as np
+
+from core import metrics
+
+# Anchor points of matplotlib's "magma" colormap (librosa's default for dB),
+# interpolated into a 256-entry lookup table so rendering needs no matplotlib
+_MAGMA_ANCHORS = np.array([
+    [0.001, 0.000, 0.014],
+    [0.079, 0.054, 0.212],
+    [0.232, 0.060, 0.438],
+    [0.390, 0.100, 0.502],
+    [0.550, 0.161, 0.506],
+    [0.716, 0.215, 0.475],
+    [0.869, 0.288, 0.409],
+    [0.967, 0.440, 0.360],
+    [0.994, 0.624, 0.427],
+    [0.987, 0.991, 0.750],
+])
+_positions = np.linspace(0.0, 1.0, len(_MAGMA_ANCHORS))
+MAGMA_LUT = np.stack([np.interp(np.linspace(0.0, 1.0, 256), _positions, _MAGMA_ANCHORS[:, channel])
+                      for channel in range(3)], axis=1)
+MAGMA_LUT = (MAGMA_LUT * 255).round().astype(np.uint8)
+
+# Mel spectrograms of recently shown audio, keyed by content hash
+CACHE_SIZE = 16
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def mel_db(samples, sr, n_mels=128, key=None):
+    """Return the mel spectrogram of `samples` in dB, computed once per distinct audio.
+
+    `key` identifies the audio (e.g. the upload's content hash); without
+    one the samples themselves are hashed.
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    key = (key or hashlib.sha1(samples).hexdigest(), sr, n_mels)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    import librosa
+    with metrics.stage('mel_spectrogram'):
+        S = librosa.feature.melspectrogram(y=samples, sr=sr, n_mels=n_mels)
+        S_DB = librosa.power_to_db(S, ref=np.max)
+
+    with _cache_lock:
+        _cache[key] = S_DB
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return S_DB
+
+
+def _shrink_columns(S_DB, width):
+    """Average groups of time frames so the spectrogram is at most `width` columns wide."""
+    columns = S_DB.shape[1]
+    if columns <= width:
+        return S_DB
+    edges = np.linspace(0, columns, width + 1).astype(int)[:-1]
+    counts = np.diff(np.append(edges, columns))
+    return np.add.reduceat(S_DB, edges, axis=1) / counts
+
+
+def render_spectrogram(samples, sr, width=1024, height=256, top_db=80.0, key=None):
+    """Render a mel spectrogram of `samples` as an RGB array.
+
+    Pure NumPy after the (cached) mel computation, so it is safe to call
+    from concurrent sessions.
+    """
+    S_DB = _shrink_columns(mel_db(samples, sr, key=key), width)
+    levels = np.clip((S_DB + top_db) / top_db, 0.0, 1.0)
+    image = MAGMA_LUT[(levels * 255).astype(np.uint8)]
+    # Low frequencies at the bottom, stretched to the requested height
+    image = image[::-1]
+    rows = np.linspace(0, image.shape[0] - 1, height).round().astype(int)
+    return image[rows]
@@ -0,0 +1,137 @@
+"""Cold-start import cost of the landing page and each Chroma page.
+
+Run from the repository root:
+
+    python -m core.startup                  # Chroma.py and every pages/*.py
+    python -m core.startup pages/Audio_Enhancement.py
+    python -m core.startup cv2 torch        # specific modules
+
+Each script or module is imported in a fresh interpreter with
+``-X importtime`` so results reflect a new container, not whatever is
+already cached. Scripts are run under a name other than ``__main__``, so
+pages execute their real imports but not their ``main()``. When Streamlit
+(or a ``streamlit_*`` component) is not installed it is replaced by a stub,
+so the rest of a page's import chain can still be timed.
+"""
+import glob
+import os
+import subprocess
+import sys
+
+# Printed once the bootstrap below has run; import lines before it are not the page's
+MARKER = '-- chroma startup --'
+STUB_PREFIX = 'chroma startup stub: '
+
+_BOOTSTRAP = f'''
+import importlib.abc, importlib.machinery, runpy, sys
+from unittest import mock
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    # Stand in for Streamlit packages that are not installed
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] == 'streamlit' or name.startswith('streamlit_'):
+            if importlib.machinery.PathFinder.find_spec(name.split('.')[0]) is None:
+                return importlib.machinery.ModuleSpec(name, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        print({STUB_PREFIX!r} + spec.name, file=sys.stderr, flush=True)
+        module = mock.MagicMock(name=spec.name)
+        module.__path__ = []
+        return module
+
+    def exec_module(self, module):
+        pass
+
+sys.meta_path.append(_StubFinder())
+print({MARKER!r}, file=sys.stderr, flush=True)
+runpy.run_path(sys.argv[1], run_name='__chroma_startup__')
+'''
+
+
+def page_scripts():
+    """The landing page and every page script, in the order Streamlit lists them."""
+    return ['Chroma.py'] + sorted(glob.glob(os.path.join('pages', '*.py')))
+
+
+def _parse(stderr, marker=None):
+    # -X importtime lines after `marker`: (self us, cumulative us, depth, name)
+    rows = []
+    started = marker is None
+    for line in stderr.splitlines():
+        if not started:
+            started = line == marker
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def _heaviest(rows, top):
+    return [(name, us / 1e6) for us, _, _, name in sorted(rows, reverse=True)[:top]]
+
+
+def import_time(module, top=5):
+    """Import `module` in a fresh interpreter.
+
+    Returns `(seconds, heaviest)` where `heaviest` lists the `top`
+    submodules by self time, or `(None, error)` if the import failed.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1]
+    rows = _parse(proc.stderr)
+    total = sum(cumulative for _, cumulative, _, name in rows if name == module)
+    return total / 1e6, _heaviest(rows, top)
+
+
+def script_import_time(path, top=5):
+    """Run the imports of the script at `path` in a fresh interpreter.
+
+    Returns `(seconds, direct, heaviest)`: the total import time, the
+    script's direct imports with their cumulative times (stubbed ones
+    marked), and the `top` modules by self time. Returns
+    `(None, error, [])` if it failed.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _BOOTSTRAP, path],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1], []
+    rows = _parse(proc.stderr, MARKER)
+    stubs = {line[len(STUB_PREFIX):] for line in proc.stderr.splitlines() if line.startswith(STUB_PREFIX)}
+    direct = sorted(((name + (' (stub)' if name in stubs else ''), cumulative / 1e6)
+                     for _, cumulative, depth, name in rows if depth == 0),
+                    key=lambda row: row[1], reverse=True)
+    total = sum(seconds for _, seconds in direct)
+    return total, direct, _heaviest(rows, top)
+
+
+def main(argv):
+    scripts = [arg for arg in argv if arg.endswith('.py')] or ([] if argv else page_scripts())
+    for path in scripts:
+        seconds, direct, heaviest = script_import_time(path)
+        if seconds is None:
+            print(f"{path}: unavailable ({direct})")
+            continue
+        print(f"{path:<36} {seconds:7.3f}s")
+        for name, cumulative in direct:
+            print(f"  {name:<34} {cumulative:7.3f}s")
+        for name, self_seconds in heaviest:
+            print(f"      {name:<40} {self_seconds:7.3f}s self")
+
+    for module in (arg for arg in argv if not arg.endswith('.py')):
+        seconds, detail = import_time(module)
+        if seconds is None:
+            print(f"{module:<36} unavailable ({detail})")
+            continue
+        print(f"{module:<36} {seconds:7.3f}s")
+        for name, self_seconds in detail:
+            print(f"      {name:<40} {self_seconds:7.3f}s self")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
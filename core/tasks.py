@@ -0,0 +1,92 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core import metrics
+
+# Finished tasks are forgotten after this many seconds
+TASK_TTL = 3600
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('CHROMA_TASK_WORKERS', '2')),
+                               thread_name_prefix='chroma-task')
+_tasks = {}
+_tasks_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+class Task:
+    """A background job the page can poll across reruns."""
+
+    def __init__(self, task_id):
+        self.id = task_id
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = 0.0
+        self.message = ''
+        self.preview = None
+        self.future = None
+        # Per-stage timings, filled in as the task runs (core.metrics.Trace)
+        self.trace = None
+
+    def report(self, progress, message='', preview=None):
+        """Called by the job to publish progress in [0, 1] and, optionally, a partial result."""
+        self.progress = min(1.0, max(0.0, progress))
+        self.message = message
+        if preview is not None:
+            self.preview = preview
+
+    @property
+    def status(self):
+        if self.finished is not None:
+            return 'failed' if self.future.exception() else 'done'
+        return 'running' if self.started is not None else 'queued'
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or self.submitted)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+
+def _prune():
+    cutoff = time.time() - TASK_TTL
+    with _tasks_lock:
+        for task_id in [task_id for task_id, task in _tasks.items()
+                        if task.finished is not None and task.finished < cutoff]:
+            del _tasks[task_id]
+
+
+def submit(fn, *args, **kwargs):
+    """Run `fn(*args, report=task.report, **kwargs)` in the background; returns the task id.
+
+    The id is a plain int so pages can keep it in st.session_state.
+    """
+    _prune()
+    task = Task(next(_ids))
+
+    def run():
+        task.started = time.time()
+        try:
+            with metrics.trace() as task.trace:
+                return fn(*args, report=task.report, **kwargs)
+        finally:
+            task.finished = time.time()
+            task.progress = 1.0
+
+    with _tasks_lock:
+        _tasks[task.id] = task
+    task.future = _executor.submit(run)
+    return task.id
+
+
+def get(task_id):
+    """Return the task with this id, or None if it is unknown or expired."""
+    with _tasks_lock:
+        return _tasks.get(task_id)
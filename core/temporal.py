@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+
+from core import metrics
+
+# Width the luminance is downsampled to before comparing frames
+DIFF_WIDTH = 64
+# Width optical flow is estimated at before being scaled back up
+FLOW_WIDTH = 320
+
+
+def _small_luma(frame_bgr, width=DIFF_WIDTH):
+    gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    height = max(1, round(h * width / w))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class KeyframeSelector:
+    """Decide which frames need a full generator pass.
+
+    A frame is a keyframe when its downsampled luminance differs from the
+    last keyframe's by more than `threshold` grey levels on average (a
+    scene cut or enough motion), or when `max_reuse` frames in a row have
+    already borrowed the last keyframe's colour.
+    """
+
+    def __init__(self, threshold=2.0, max_reuse=12):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self._key_luma = None
+        self._reused = 0
+
+    def is_keyframe(self, frame_bgr):
+        luma = _small_luma(frame_bgr)
+        if (self._key_luma is None or self._key_luma.shape != luma.shape
+                or self._reused >= self.max_reuse
+                or np.abs(luma - self._key_luma).mean() > self.threshold):
+            self._key_luma = luma
+            self._reused = 0
+            return True
+        self._reused += 1
+        return False
+
+
+def _warp_chroma(chroma, key_gray, frame_gray):
+    """Move the keyframe's chroma along the optical flow to the current frame."""
+    h, w = frame_gray.shape
+    scale = min(1.0, FLOW_WIDTH / w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    flow = cv2.calcOpticalFlowFarneback(cv2.resize(frame_gray, size), cv2.resize(key_gray, size),
+                                        None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    flow = cv2.resize(flow, (w, h)) / scale
+    grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+    return cv2.remap(chroma, grid_x + flow[..., 0], grid_y + flow[..., 1],
+                     interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def reuse_chroma(key_rgb, frame_bgr, key_gray=None):
+    """Colour `frame_bgr` with the chroma of an already colorized keyframe.
+
+    Keeps the frame's own luminance, like DeOldify's post-processing does.
+    When `key_gray` (the keyframe's original grayscale) is given, the
+    chroma is first propagated along the optical flow between the frames.
+    """
+    frame_yuv = cv2.cvtColor(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB), cv2.COLOR_RGB2YUV)
+    chroma = cv2.cvtColor(key_rgb, cv2.COLOR_RGB2YUV)[:, :, 1:3]
+    if key_gray is not None:
+        chroma = _warp_chroma(chroma, key_gray, cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY))
+    frame_yuv[:, :, 1:3] = chroma
+    return cv2.cvtColor(frame_yuv, cv2.COLOR_YUV2RGB)
+
+
+class TemporalReuse:
+    """Wrap a batch colorizer so only keyframes go through the generator.
+
+    `colorize_batch` maps a list of BGR frames to RGB arrays. Frames close
+    enough to the last keyframe reuse its chroma (optionally warped with
+    optical flow) instead. State carries across calls, so feed batches in
+    frame order.
+    """
+
+    def __init__(self, colorize_batch, threshold=2.0, max_reuse=12, flow=False):
+        self.colorize_batch = colorize_batch
+        self.selector = KeyframeSelector(threshold, max_reuse)
+        self.flow = flow
+        self.frames = 0
+        self.skipped = 0
+        self._key_rgb = None
+        self._key_gray = None
+
+    def __call__(self, frames):
+        keyframe_flags = [self.selector.is_keyframe(frame) for frame in frames]
+        keyframes = [frame for frame, is_key in zip(frames, keyframe_flags) if is_key]
+        colorized = iter(self.colorize_batch(keyframes) if keyframes else [])
+
+        results = []
+        for frame, is_key in zip(frames, keyframe_flags):
+            if is_key:
+                self._key_rgb = next(colorized)
+                if self.flow:
+                    self._key_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                results.append(self._key_rgb)
+            else:
+                with metrics.stage('reuse_chroma'):
+                    results.append(reuse_chroma(self._key_rgb, frame, self._key_gray))
+                self.skipped += 1
+        self.frames += len(frames)
+        return results
+
+    @property
+    def skipped_fraction(self):
+        return self.skipped / self.frames if self.frames else 0.0
@@ -0,0 +1,86 @@
+"""Shared page styling: the background image and sidebar colours.
+
+The background is served as a static asset (``static/`` is exposed at
+``app/static/`` when ``server.enableStaticServing`` is on, see
+.streamlit/config.toml) so reruns only resend a short URL. When static
+serving is off it falls back to inlining a downscaled WebP copy.
+
+Regenerate the WebP after changing static/bg.png with:
+
+    python -m core.theme
+"""
+import base64
+import functools
+import os
+
+import streamlit as st
+
+BACKGROUND_PATH = os.path.join('static', 'bg.png')
+BACKGROUND_WEBP_PATH = os.path.join('static', 'bg.webp')
+# Wide enough for 1080p/1440p screens; the background is blurred scenery
+BACKGROUND_WIDTH = 1920
+
+# CSS to inject specifying the background image
+BACKGROUND_CSS = """
+<style>
+.stApp {{
+    background-image: url('{url}');
+    background-size: cover;
+    background-position: center;
+    background-repeat: no-repeat;
+    background-attachment: fixed;
+    color: black;  /* Set text color to black */
+}}
+
+/* Style for the sidebar (white with blur effect) */
+.stSidebar {{
+    background-color: #ba90e3; /* Change sidebar color */
+    backdrop-filter: blur(16px);
+}}
+/* Additional styling may be needed for other sidebar elements */
+.css-1l02zno {{
+    background-color: #ba90e3; /* Change sidebar color */
+    backdrop-filter: blur(8px);
+}}
+</style>
+"""
+
+
+def make_background_webp(source=BACKGROUND_PATH, target=BACKGROUND_WEBP_PATH, width=BACKGROUND_WIDTH):
+    """Write a downscaled WebP copy of the background image."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        height = round(image.height * width / image.width)
+        image.convert('RGB').resize((width, height), Image.LANCZOS).save(target, 'WEBP', quality=80, method=6)
+
+
+def _static_serving_enabled():
+    try:
+        return bool(st.get_option('server.enableStaticServing'))
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def background_css():
+    """Build the page CSS once per process."""
+    if not os.path.exists(BACKGROUND_WEBP_PATH):
+        make_background_webp()
+
+    if _static_serving_enabled():
+        url = 'app/static/' + os.path.basename(BACKGROUND_WEBP_PATH)
+    else:
+        with open(BACKGROUND_WEBP_PATH, 'rb') as image_file:
+            url = 'data:image/webp;base64,' + base64.b64encode(image_file.read()).decode()
+    return BACKGROUND_CSS.format(url=url)
+
+
+def apply_theme():
+    """Inject the shared background and sidebar styling into the current page."""
+    st.markdown(background_css(), unsafe_allow_html=True)
+
+
+if __name__ == '__main__':
+    make_background_webp()
+    print(f"Wrote {BACKGROUND_WEBP_PATH} ({os.path.getsize(BACKGROUND_WEBP_PATH) / 1024:.0f} KB)")
@@ -0,0 +1,198 @@
+import os
+import time
+
+import streamlit as st
+
+from core import inference, jobs, metrics, scratch
+from core.cache import hash_bytes, results
+from core.precision import DEFAULT_PRECISION, PRECISIONS
+from core.video import ENCODER_PRESET, ENCODER_PRESETS
+
+
+def cache_status():
+    """Show result-cache counters in the sidebar."""
+    stats = results.stats()
+    st.sidebar.caption(f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                       f"{stats['entries']} entries ({stats['size_mb']} / {stats['max_mb']} MB)")
+
+
+def precision_option():
+    """Sidebar control for the generator's inference mode (see core.precision)."""
+    return st.sidebar.selectbox("Inference precision", PRECISIONS, index=PRECISIONS.index(DEFAULT_PRECISION),
+                                help="Reduced-precision modes run faster on CPU with slightly different colours")
+
+
+def video_options(pool=True):
+    """Sidebar controls shared by the video pages; returns colorize_video_file kwargs.
+
+    Without `pool` the CPU worker pool is not offered, for pipelines that
+    cannot split the video across processes.
+    """
+    cpus = os.cpu_count() or 1
+    st.sidebar.subheader("Performance")
+
+    # Frames per forward pass; 0 sizes batches to the available RAM
+    batch_size = st.sidebar.number_input("Frames per batch (0 = auto)", min_value=0, max_value=64, value=0)
+
+    # Worker processes each hold their own model copy and colorize whole segments
+    use_pool = pool and st.sidebar.checkbox("Use CPU worker pool", value=False)
+    workers = 0
+    threads_per_worker = 1
+    if use_pool:
+        threads_per_worker = st.sidebar.number_input("Threads per worker", min_value=1, max_value=cpus,
+                                                     value=min(2, cpus))
+        workers = st.sidebar.number_input("Workers", min_value=1, max_value=cpus,
+                                          value=max(1, cpus // threads_per_worker))
+
+    # Static shots reuse the last keyframe's colour instead of running the generator
+    reuse_threshold = 0.0
+    max_reuse = 12
+    flow = False
+    if st.sidebar.checkbox("Reuse colour across similar frames", value=False):
+        reuse_threshold = st.sidebar.slider("Change threshold (grey levels)", min_value=0.5, max_value=20.0,
+                                            value=2.0, step=0.5)
+        max_reuse = st.sidebar.slider("Max frames between keyframes", min_value=1, max_value=120, value=12)
+        flow = st.sidebar.checkbox("Follow motion with optical flow", value=False)
+
+    # x264 preset for the final encode; faster presets give larger files
+    preset = st.sidebar.selectbox("Encoder preset", ENCODER_PRESETS, index=ENCODER_PRESETS.index(ENCODER_PRESET))
+
+    precision = precision_option()
+
+    return {
+        'batch_size': int(batch_size),
+        'workers': int(workers),
+        'threads_per_worker': int(threads_per_worker),
+        'reuse_threshold': float(reuse_threshold),
+        'max_reuse': int(max_reuse),
+        'flow': flow,
+        'preset': preset,
+        'precision': precision,
+    }
+
+
+def session_workspace(name, size_hint=0):
+    """Scratch workspace for this browser session's `name` files, kept across reruns.
+
+    `size_hint` is the size of the file about to be written. Files known to
+    be small go to a RAM-backed workspace while the RAM quota has room for
+    them; larger files and files of unknown size, such as outputs, go to a
+    disk workspace. Nothing signals the end of a session, so workspaces are
+    removed once idle for scratch.SCRATCH_TTL seconds.
+    """
+    tiers = ['ram', 'disk'] if scratch.fits_ram(size_hint) else ['disk']
+    for tier in tiers:
+        key = f'workspace_{name}_{tier}'
+        workspace = st.session_state.get(key)
+        try:
+            if workspace is None or not workspace.exists():
+                workspace = (scratch.ram if tier == 'ram' else scratch.disk).create(f'session-{name}', size_hint)
+                st.session_state[key] = workspace
+            else:
+                # Touched first so the sweep never evicts the workspace being written to
+                workspace.touch()
+                if size_hint:
+                    workspace.space.sweep(need=size_hint)
+        except scratch.ScratchFull:
+            if tier == tiers[-1]:
+                raise
+            continue
+        workspace.touch()
+        return workspace
+
+
+def saved_upload(uploaded_file, name):
+    """Write `uploaded_file` to this session's scratch space once per upload.
+
+    Reruns (e.g. from moving a slider) reuse the saved file and its
+    content hash instead of writing and hashing the upload again.
+    Returns `(path, content hash)`.
+    """
+    key = f'upload_{name}'
+    # file_id changes with every new upload, even of the same file
+    upload_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    saved = st.session_state.get(key)
+    if saved is None or saved['id'] != upload_id or not os.path.exists(saved['path']):
+        # Each upload is placed by its own size, so a large one never lands in RAM
+        workspace = session_workspace(name, size_hint=uploaded_file.size)
+        if saved is not None and os.path.exists(saved['path']):
+            os.remove(saved['path'])
+        data = uploaded_file.getvalue()
+        path = workspace.file('upload' + (os.path.splitext(uploaded_file.name)[1] or '.bin'))
+        with open(path, 'wb') as f, metrics.stage('upload_write'):
+            f.write(data)
+        saved = {'id': upload_id, 'path': path, 'hash': hash_bytes(data)}
+        st.session_state[key] = saved
+    else:
+        os.utime(os.path.dirname(saved['path']))
+    return saved['path'], saved['hash']
+
+
+def trace_option():
+    """Sidebar toggle for the per-request timing trace."""
+    return st.sidebar.checkbox("Show timing trace", value=False)
+
+
+def show_trace(rows, title="Timing trace"):
+    """Show per-stage timings (core.metrics.Trace.rows) in an expander."""
+    if not rows:
+        return
+    with st.expander(title):
+        st.caption("Stages run in parallel threads overlap, so totals can exceed the wall time.")
+        st.dataframe(rows, use_container_width=True)
+
+
+def _server_queue_depth():
+    # Images waiting on the shared inference server, or None without one
+    remote = inference.client()
+    if remote is None:
+        return None
+    try:
+        return remote.stats()['queue_depth']
+    except (inference.ServerUnavailable, RuntimeError):
+        return None
+
+
+def job_progress(job_id, unit='frames'):
+    """Follow a background job across reruns and browser refreshes.
+
+    While the job is queued or running this shows its progress, ETA and a
+    cancel button, then reruns the page every second. Afterwards it shows
+    failures and cancellations, and returns the job once it is done and
+    its result is still on disk.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        st.warning("That colorization job has expired.")
+        st.query_params.pop('job', None)
+        return None
+    if job.status == 'done':
+        # Cached results can be evicted from the result cache afterwards
+        if job.result is None or not os.path.exists(job.result):
+            st.warning("That colorization result has expired. Please colorize it again.")
+            st.query_params.pop('job', None)
+            return None
+        return job
+    if job.status == 'failed':
+        st.error(f"Colorization failed: {job.error}")
+        return None
+    if job.status == 'cancelled':
+        st.info("Colorization was cancelled.")
+        return None
+
+    if job.status == 'queued':
+        text = "Waiting for a free worker..."
+    else:
+        text = f"{job.message or 'Working'}: {job.done} / {job.total} {unit}"
+        if job.eta is not None:
+            text += f", about {job.eta:.0f}s left"
+        depth = _server_queue_depth()
+        if depth:
+            text += f" ({depth} images queued for the model)"
+    st.progress(job.fraction, text=text)
+    if job.cancel_requested:
+        st.caption("Cancelling...")
+    elif st.button("Cancel"):
+        jobs.cancel(job_id)
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,336 @@
+import contextvars
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a frame queue
+_DONE = object()
+
+
+class _End:
+    """Queue item marking the end of a prefetched stream."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def read_frames(video_path, start=0, count=None):
+    """Yield the BGR frames of `video_path` one at a time.
+
+    `start` and `count` restrict decoding to a frame range; seeking lands
+    on the exact frame for the constant-frame-rate files we handle.
+    """
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        read = 0
+        while cap.isOpened() and (count is None or read < count):
+            with metrics.stage('decode'):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            read += 1
+            yield frame
+    finally:
+        cap.release()
+
+
+def source_fps(video_path, default=24.0):
+    """Return the frame rate of `video_path` as an exact fraction, e.g. 30000/1001.
+
+    Falls back to `default` when the container doesn't report one.
+    """
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+    finally:
+        cap.release()
+    if not fps or fps != fps or fps > 1000:
+        fps = default
+    # Containers store NTSC-style rates as n/1001; recover them exactly
+    return Fraction(fps).limit_denominator(1001)
+
+
+def frame_count(video_path):
+    """Return the number of frames the container reports for `video_path` (0 if unknown)."""
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    finally:
+        cap.release()
+
+
+def prefetch(iterable, maxsize=8):
+    """Drain `iterable` on a background thread, buffering at most `maxsize` items.
+
+    Lets decoding run ahead of the consumer without holding more than
+    `maxsize` frames in memory. Exceptions are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_End(e))
+            return
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+        put(_End())
+
+    # Run in a copy of this context so stages it times join the caller's trace
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        # Unblock the producer if the consumer stopped early
+        stop.set()
+        thread.join()
+
+
+# x264 speed/size trade-off and encoder threads (0 lets ffmpeg decide)
+ENCODER_PRESET = os.environ.get('CHROMA_ENCODER_PRESET', 'veryfast')
+ENCODER_THREADS = int(os.environ.get('CHROMA_ENCODER_THREADS', '0'))
+ENCODER_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow')
+# Soundtracks in these codecs are copied into the mp4 as they are; others
+# (PCM from .avi/.mov, Vorbis or Opus from .mkv) do not play in browsers
+# and are re-encoded to AAC
+MP4_AUDIO_CODECS = ('aac', 'mp3')
+
+
+def ffmpeg_exe():
+    """Return the ffmpeg binary: $CHROMA_FFMPEG, one on PATH, or the one bundled for moviepy."""
+    exe = os.environ.get('CHROMA_FFMPEG') or shutil.which('ffmpeg')
+    if exe:
+        return exe
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def audio_codec(path):
+    """Return the codec name of the first audio stream of `path`, or None if it has none."""
+    proc = subprocess.run([ffmpeg_exe(), '-hide_banner', '-i', path], stdin=subprocess.DEVNULL,
+                          capture_output=True)
+    # With no output given ffmpeg exits with an error after describing the input
+    match = re.search(r'Stream #\S+: Audio: (\w+)', proc.stderr.decode(errors='replace'))
+    return match.group(1) if match else None
+
+
+def _audio_codec_args(audio_path):
+    if audio_codec(audio_path) in MP4_AUDIO_CODECS + (None,):
+        return ['-c:a', 'copy']
+    return ['-c:a', 'aac', '-b:a', '192k']
+
+
+def encoder_command(path, width, height, fps, audio_path=None, preset=ENCODER_PRESET,
+                    threads=ENCODER_THREADS):
+    """ffmpeg arguments that encode raw RGB frames from stdin into `path`.
+
+    With `audio_path`, its first audio stream (if any) is muxed in the same
+    pass: copied as-is when it is AAC or MP3, otherwise encoded to AAC.
+    """
+    command = [ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps),
+               '-i', 'pipe:0']
+    if audio_path is not None:
+        command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0?', *_audio_codec_args(audio_path),
+                    '-shortest']
+    command += ['-c:v', 'libx264', '-preset', preset, '-threads', str(threads),
+                # yuv420p needs even dimensions
+                '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p',
+                '-movflags', '+faststart', path]
+    return command
+
+
+class FrameWriter:
+    """Encode RGB frames to an H.264 mp4 file on a background thread.
+
+    Frames are piped raw into a single ffmpeg process, which also muxes
+    the audio of `audio_path` when given, so every frame is encoded once.
+    `write` blocks once `maxsize` frames are waiting, so a slow encoder
+    applies backpressure instead of letting frames pile up in memory.
+    """
+
+    def __init__(self, path, fps=24.0, maxsize=8, audio_path=None, preset=ENCODER_PRESET,
+                 threads=ENCODER_THREADS):
+        self.path = path
+        self.fps = fps
+        self.audio_path = audio_path
+        self.preset = preset
+        self.threads = threads
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        proc = None
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is _DONE:
+                    break
+                if proc is None:
+                    frame_height, frame_width, _ = frame.shape
+                    command = encoder_command(self.path, frame_width, frame_height, self.fps,
+                                              self.audio_path, self.preset, self.threads)
+                    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                with metrics.stage('encode'):
+                    proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+                self.frames_written += 1
+        except BaseException as e:
+            # A broken pipe means ffmpeg exited early; its own message says why
+            self._error = self._encoder_error(proc) if isinstance(e, BrokenPipeError) else e
+            # Keep draining so the producer never blocks on a dead encoder
+            while self._queue.get() is not _DONE:
+                pass
+        finally:
+            if proc is not None:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+                if proc.wait() != 0 and self._error is None:
+                    self._error = self._encoder_error(proc)
+
+    def _encoder_error(self, proc):
+        proc.wait()
+        stderr = proc.stderr.read().decode(errors='replace').strip()
+        return RuntimeError(f"ffmpeg failed encoding {self.path}: {stderr}")
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(_DONE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.frames_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._queue.put(_DONE)
+            self._thread.join()
+
+
+def concat_segments(paths, output_path, audio_path=None):
+    """Join mp4 segments encoded with the same settings into `output_path` without re-encoding.
+
+    With `audio_path`, its first audio stream (if any) is added too, as in
+    `encoder_command`.
+    """
+    list_path = output_path + '.txt'
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path is not None:
+        command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0?']
+    command += ['-c', 'copy']
+    if audio_path is not None:
+        command += _audio_codec_args(audio_path)
+    command += ['-movflags', '+faststart', output_path]
+    try:
+        with metrics.stage('mux'):
+            proc = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+    finally:
+        os.remove(list_path)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed joining segments into {output_path}: "
+                           f"{proc.stderr.decode(errors='replace').strip()}")
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` consecutive items from `iterable`."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def colorize_to_file(video_path, output_path, colorize_batch, batch_size=1, fps=None, queue_size=8,
+                     start=0, count=None, progress=None, **encoder_options):
+    """Stream `video_path` through `colorize_batch` into an mp4 at `output_path`.
+
+    Decoding, colorization and encoding run concurrently, connected by
+    bounded queues, so memory stays constant regardless of clip length.
+    `colorize_batch` takes a list of up to `batch_size` BGR frames and
+    returns the matching list of RGB arrays. The output keeps the source
+    frame rate unless `fps` is given. `start` and `count` restrict it to
+    a frame range, and `progress` is called with the number of frames
+    colorized so far after every batch. `encoder_options` go to
+    FrameWriter (e.g. `audio_path` to keep a soundtrack). Returns the
+    number of frames written.
+    """
+    queue_size = max(queue_size, batch_size)
+    fps = fps or source_fps(video_path)
+    started = time.perf_counter()
+    colorized_frames = 0
+    with FrameWriter(output_path, fps=fps, maxsize=queue_size, **encoder_options) as writer:
+        frames = prefetch(read_frames(video_path, start=start, count=count), maxsize=queue_size)
+        try:
+            for batch in batched(frames, batch_size):
+                for colorized in colorize_batch(batch):
+                    writer.write(colorized)
+                colorized_frames += len(batch)
+                if progress is not None:
+                    progress(colorized_frames)
+        finally:
+            # Stop the decoder thread now rather than when the traceback is collected
+            frames.close()
+    elapsed = time.perf_counter() - started
+    logger.info("Colorized %d frames in %.1fs (%.2f fps)", writer.frames_written,
+                elapsed, writer.frames_written / elapsed if elapsed else 0.0)
+    return writer.frames_written
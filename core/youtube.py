@@ -0,0 +1,433 @@
+"""Colorize online videos while they download.
+
+`colorize_url` starts decoding and colorizing as soon as the first frames
+have arrived instead of waiting for the whole file. YouTube links are
+resolved with pytube to the smallest progressive mp4 stream whose height
+covers the model's input size; any other http(s) URL is fetched as is,
+which is also how the pipeline is exercised offline:
+
+    python -m http.server --directory Data 8000
+    # then colorize http://127.0.0.1:8000/Test%20video.mp4
+
+Progressive decoding needs the mp4 index ('moov') ahead of the media data,
+as YouTube's progressive streams have it. Other files are colorized once
+the download completes.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import re
+import struct
+import subprocess
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+from core import metrics
+from core.video import FrameWriter, batched, concat_segments, ffmpeg_exe, frame_count, source_fps
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtu.be', 'music.youtube.com')
+CHUNK_BYTES = 256 * 1024
+TIMEOUT_SECONDS = 30
+# YouTube video ids are 11 characters from this alphabet
+_VIDEO_ID = re.compile(r'[0-9A-Za-z_-]{11}')
+
+
+def is_youtube(url):
+    return urllib.parse.urlsplit(url).hostname in YOUTUBE_HOSTS
+
+
+def video_id(url):
+    """Return the id of the YouTube video `url` links to, or None.
+
+    watch?v=, youtu.be/ and the /shorts/, /embed/, /live/ and /v/ forms of
+    a link all give the same id; timestamps, playlists and other parameters
+    are ignored.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.hostname not in YOUTUBE_HOSTS:
+        return None
+    path = parts.path.strip('/').split('/')
+    if parts.hostname == 'youtu.be':
+        candidate = path[0]
+    elif path[0] in ('shorts', 'embed', 'live', 'v') and len(path) > 1:
+        candidate = path[1]
+    else:
+        candidate = urllib.parse.parse_qs(parts.query).get('v', [''])[0]
+    return candidate if _VIDEO_ID.fullmatch(candidate) else None
+
+
+def choose_stream(streams, render_factor, render_base=16, highest=False):
+    """Pick the smallest stream at least `render_factor * render_base` pixels high.
+
+    `streams` are pytube Streams (anything with a `resolution` like '360p').
+    Falls back to the highest resolution when none is large enough, or
+    when `highest` is set.
+    """
+    streams = sorted((s for s in streams if s.resolution), key=lambda s: int(s.resolution.rstrip('p')))
+    if not streams:
+        return None
+    if not highest:
+        render_sz = render_factor * render_base
+        for stream in streams:
+            if int(stream.resolution.rstrip('p')) >= render_sz:
+                return stream
+    return streams[-1]
+
+
+def resolve(url, render_factor, highest=False):
+    """Return the direct media URL to download for `url`."""
+    if not is_youtube(url):
+        return url
+    from pytube import YouTube
+
+    # Progressive streams carry the audio too, so nothing needs merging
+    streams = YouTube(url).streams.filter(progressive=True, file_extension='mp4')
+    stream = choose_stream(streams, render_factor, highest=highest)
+    if stream is None:
+        raise RuntimeError("No suitable streams found for the provided YouTube URL")
+    logger.info("Downloading the %s stream of %s", stream.resolution, url)
+    return stream.url
+
+
+class Download:
+    """Fetch `url` into `path` on a background thread, announcing every chunk.
+
+    With `resume`, a partial file left by an earlier run is continued with
+    an HTTP range request guarded by If-Range, so a resource that changed
+    meanwhile is fetched afresh, and a completed file is not fetched again.
+    `resumed` tells whether the earlier bytes were kept.
+    """
+
+    def __init__(self, url, path, resume=False):
+        self.url = url
+        self.path = path
+        self.received = 0
+        self.total = None
+        self.error = None
+        self.finished = False
+        self.cancelled = False
+        self.resumed = False
+        self._changed = threading.Condition()
+        self._state_path = path + '.state'
+        state = self._read_state() if resume else None
+        self._offset = os.path.getsize(path) if state and os.path.exists(path) else 0
+        if state and state.get('complete') and self._offset == state.get('size'):
+            self.received = self.total = self._offset
+            self.resumed = self.finished = True
+            self._validator = None
+            self._thread = None
+            return
+        self._validator = state.get('validator') if state else None
+        if not self._offset or not self._validator:
+            # Readers may open the file before the first bytes arrive
+            open(path, 'wb').close()
+            self._offset = 0
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True,
+                                        name='chroma-download')
+        self._thread.start()
+
+    def _read_state(self):
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, **state):
+        with open(self._state_path, 'w') as f:
+            json.dump(state, f)
+
+    def _open(self):
+        if self._offset:
+            request = urllib.request.Request(self.url, headers={'Range': f'bytes={self._offset}-',
+                                                                'If-Range': self._validator})
+            try:
+                response = urllib.request.urlopen(request, timeout=TIMEOUT_SECONDS)
+            except urllib.error.HTTPError as e:
+                # 416: the partial file is not a prefix of the resource any more
+                if e.code != 416:
+                    raise
+            else:
+                # 206 continues the partial file; 200 is the whole changed resource
+                return response
+        return urllib.request.urlopen(self.url, timeout=TIMEOUT_SECONDS)
+
+    def _run(self):
+        try:
+            with self._open() as response, metrics.stage('download'):
+                resumed = response.status == 206
+                offset = self._offset if resumed else 0
+                length = response.headers.get('Content-Length')
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                self._write_state(validator=validator, complete=False)
+                with open(self.path, 'ab' if resumed else 'wb') as f:
+                    with self._changed:
+                        self.total = offset + int(length) if length else None
+                        self.received = offset
+                        self.resumed = resumed
+                        self._changed.notify_all()
+                    while not self.cancelled:
+                        chunk = response.read(CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        f.flush()
+                        with self._changed:
+                            self.received += len(chunk)
+                            self._changed.notify_all()
+            if not self.cancelled and self.total is not None and self.received < self.total:
+                raise IOError(f"Download ended after {self.received} of {self.total} bytes")
+            if not self.cancelled:
+                self._write_state(validator=validator, complete=True, size=self.received)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    def wait_for(self, size):
+        """Block until `size` bytes have arrived or the download ended; returns the bytes received."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.received >= size or self.finished)
+            return self.received
+
+    def wait(self):
+        """Block until the download ends; raises its error if it failed."""
+        if self._thread is not None:
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        self.cancelled = True
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def fraction(self):
+        return self.received / self.total if self.total else None
+
+
+def _index_end(download):
+    """Return where the mp4 index ends if it comes before the media data, else None."""
+    offset = 0
+    with open(download.path, 'rb') as f:
+        while True:
+            if download.wait_for(offset + 16) < offset + 8:
+                return None
+            f.seek(offset)
+            size, box = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+            if box == b'moov':
+                return offset + size
+            if box == b'mdat' or size < 8:
+                return None
+            offset += size
+
+
+def _feed(download, stdin):
+    # Copy the file to the decoder as it grows, never past the bytes this download wrote
+    try:
+        with open(download.path, 'rb') as f:
+            position = 0
+            while True:
+                available = download.wait_for(position + 1) - position
+                if available <= 0 or download.cancelled:
+                    break
+                chunk = f.read(min(available, CHUNK_BYTES))
+                if not chunk:
+                    break
+                stdin.write(chunk)
+                position += len(chunk)
+    except (BrokenPipeError, ValueError):
+        # The decoder exited (or was stopped) early
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def read_frames_progressive(download, width, height):
+    """Yield BGR frames of the file `download` is fetching, decoding as the bytes arrive."""
+    command = [ffmpeg_exe(), '-v', 'error', '-i', 'pipe:0',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-vf', f'scale={width}:{height}', 'pipe:1']
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    feeder = threading.Thread(target=_feed, args=(download, proc.stdin), daemon=True)
+    feeder.start()
+    # ffmpeg's error output is only read at the end; keep it from filling the pipe
+    stderr = []
+    drain = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    frame_bytes = width * height * 3
+    try:
+        while True:
+            with metrics.stage('decode'):
+                data = proc.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        feeder.join()
+        drain.join()
+    if proc.returncode not in (0, -9) and download.error is None:
+        raise RuntimeError(f"Decoding failed: {stderr[0].decode(errors='replace').strip()}")
+
+
+def _probe(path):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+
+class _Cached(Exception):
+    def __init__(self, path):
+        self.path = path
+
+
+def colorize_url(url, download_path, output_path, render_factor, kind='artistic', batch_size=0,
+                 post_process=True, reuse_threshold=0.0, max_reuse=12, flow=False, precision='fp32',
+                 preset=None, encoder_threads=None, highest=False, progress=None, segment_seconds=0,
+                 completed=None, checkpoint=None, downloaded=None):
+    """Download `url` to `download_path` and colorize it into `output_path` at the same time.
+
+    `progress(frames_done, frames_total, message)` is called after every
+    batch; raising from it (e.g. on cancellation) stops the download too.
+    With `segment_seconds` the video is colorized into segments of about
+    that length next to `output_path`, and `checkpoint(index, path, frames,
+    skipped)` is called as each one is finished. A partial download left at
+    `download_path` by an earlier run is resumed, and the segments that run
+    finished, passed as `completed` ({index: (path, frames, skipped)}), are
+    decoded but not colorized again. `downloaded(path)` is called once the download is
+    complete and may return the path of an existing result to use instead.
+    The other options are as for core.pipeline.colorize_video_file.
+    Returns a dict with the number of frames written, how many skipped the
+    generator, and the result's path.
+    """
+    from core.colorize import auto_batch_size
+    from core.pipeline import make_frame_colorizer
+    from core.video import read_frames
+
+    completed = dict(completed or {})
+    download = Download(resolve(url, render_factor, highest), download_path, resume=True)
+    output_dir = os.path.dirname(output_path)
+    frames = None
+    paths = []
+    try:
+        index_end = _index_end(download)
+        if index_end is not None and download.wait_for(index_end) >= index_end:
+            # The index is in: the container already knows the frame rate, size and length
+            width, height = _probe(download_path)
+            frames = read_frames_progressive(download, width, height)
+        else:
+            logger.info("%s is not laid out for streaming; colorizing after the download", url)
+            download.wait()
+            frames = read_frames(download_path)
+        if download.error is not None:
+            raise download.error
+        if not download.resumed:
+            # Fetched afresh, so earlier segments may not match it
+            completed = {}
+        fps = source_fps(download_path)
+        total = frame_count(download_path)
+        segment_frames = max(1, round(float(fps) * segment_seconds)) if segment_seconds else None
+
+        batch_size = batch_size or auto_batch_size(render_factor)
+        colorize, reuse = make_frame_colorizer(render_factor, kind, post_process, reuse_threshold=reuse_threshold,
+                                               max_reuse=max_reuse, flow=flow, precision=precision)
+        encoder_options = {key: value for key, value in (('preset', preset), ('threads', encoder_threads))
+                           if value is not None}
+        checked = False
+
+        def check_download():
+            nonlocal checked
+            if not checked and downloaded and download.finished and download.error is None:
+                checked = True
+                cached = downloaded(download_path)
+                if cached:
+                    raise _Cached(cached)
+
+        done = 0
+        skipped = 0
+        for index in itertools.count():
+            check_download()
+            segment = itertools.islice(frames, segment_frames)
+            first = next(segment, None)
+            if first is None:
+                break
+            segment = itertools.chain([first], segment)
+            if index in completed:
+                path, count, segment_skipped = completed[index]
+                if sum(1 for _ in segment) != count:
+                    raise RuntimeError(f"Segment {index} no longer matches the download")
+                if progress:
+                    progress(done + count, max(total, done + count), "Skipping frames colorized before a restart")
+            else:
+                path = os.path.join(output_dir, f'segment{index:05d}.mp4')
+                partial = os.path.join(output_dir, f'segment{index:05d}.part.mp4')
+                skipped_before = reuse.skipped if reuse else 0
+                count = 0
+                with FrameWriter(partial, fps=fps, **encoder_options) as writer:
+                    for batch in batched(segment, batch_size):
+                        for colorized in colorize(batch):
+                            writer.write(colorized)
+                        count += len(batch)
+                        metrics.inc('frames_colorized', len(batch))
+                        if progress:
+                            fraction = download.fraction
+                            message = ("Colorizing" if download.finished or fraction is None
+                                       else f"Colorizing while downloading ({fraction:.0%} downloaded)")
+                            progress(done + count, max(total, done + count), message)
+                        check_download()
+                os.replace(partial, path)
+                segment_skipped = (reuse.skipped if reuse else 0) - skipped_before
+                if checkpoint:
+                    checkpoint(index, path, count, segment_skipped)
+            paths.append(path)
+            done += count
+            skipped += segment_skipped
+            if segment_frames is None or count < segment_frames:
+                break
+        download.wait()
+        check_download()
+        if not done:
+            raise RuntimeError("No frames could be read from the video")
+
+        if progress:
+            progress(done, done, "Muxing audio")
+        # The soundtrack is copied from the finished download
+        concat_segments(paths, output_path, audio_path=download_path)
+        result = output_path
+    except _Cached as cached:
+        done = skipped = 0
+        result = cached.path
+    finally:
+        # Stop the download first so the decoder's feeder is not left waiting for bytes
+        if not download.finished:
+            download.cancel()
+        if frames is not None:
+            frames.close()
+        for name in os.listdir(output_dir or '.'):
+            if name.startswith('segment') and name.endswith('.part.mp4'):
+                os.remove(os.path.join(output_dir, name))
+    for path in paths:
+        os.remove(path)
+    return {'frames': done, 'skipped': skipped, 'skipped_fraction': skipped / done if done else 0.0,
+            'path': result}
@@ -1,113 +1,112 @@
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
-from voicefixer import VoiceFixer
-import IPython.display as ipd
-import librosa
-import librosa.display
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-from scipy import signal
+import os
+import time
 import streamlit as st
-import base64
+from core import audio, scratch, tasks
+from core.audio import CHUNK_SECONDS, OVERLAP_SECONDS, SAMPLE_RATE, VOICEFIXER_SEGMENT_SECONDS, restore_chunked
+from core.spectrogram import render_spectrogram
+from core.theme import apply_theme
+from core.ui import saved_upload, session_workspace, show_trace, trace_option
 
-def load_audio(file_path):
-    sr = 44100  # Define the 'sr' variable with a value
-    y, sr = librosa.load(file_path, mono=True, sr=sr, offset=0, duration=10)
-    return y, sr
+# librosa, scipy and voicefixer are imported where they are used
+# so the page renders its uploader without paying for them
+
+# Seconds of audio decoded for the spectrograms; playback and enhancement use the whole file
+SPECTROGRAM_SECONDS = 60
+
+def load_audio(file_path, duration=SPECTROGRAM_SECONDS):
+    # Memory-mapped at the file's own rate; the spectrogram needs no resampling
+    return audio.load_audio(file_path, duration=duration)
 
 def freq(y, sr):
+    from scipy import signal
     b, a = signal.butter(10, 2000/(sr/2), btype='highpass')
     yf = signal.lfilter(b, a, y)
     return yf
 
-def show_spectrogram(samples, sr, title):
-    plt.figure(figsize=(12, 4))
-    plt.title(title)
-    S = librosa.feature.melspectrogram(y=samples, sr=sr)
-    S_DB = librosa.power_to_db(S, ref=np.max)
-    librosa.display.specshow(S_DB, sr=sr, x_axis='time', y_axis='mel')
-    plt.colorbar(format='%+2.0f dB')
-    plt.xlabel('Time')
-    plt.ylabel('Frequency (Hz)')
-    plt.tight_layout()
-    st.pyplot()
-
-def get_base64_of_image(file_path):
-    """Encode the image as base64."""
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
-    return encoded_string
+def show_spectrogram(samples, sr, title, key=None):
+    # Rendered straight to an RGB array; the mel spectrogram is cached per audio
+    st.image(render_spectrogram(samples, sr, key=key), caption=f"{title} (mel scale, 0 to -80 dB)",
+             use_column_width=True)
+
+def restore_in(workspace, input_file, output_file, **kwargs):
+    # The lease keeps the scratch sweep off the output for as long as the restore runs
+    with workspace.busy():
+        return restore_chunked(input_file, output_file, **kwargs)
 
 def main():
-    # Path to your image
-    image_path = 'static/bg.png'
-    encoded_image = get_base64_of_image(image_path)
-
-    # CSS to inject specifying the background image
-    background_image_css = f"""
-    <style>
-    .stApp {{
-        background-image: url('data:image/png;base64,{encoded_image}');
-        background-size: cover;
-        background-position: center;
-        background-repeat: no-repeat;
-        background-attachment: fixed;
-        color: black;  /* Set text color to black */
-    }}
-    
-    /* Style for the sidebar (white with blur effect) */
-    .stSidebar {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(16px);
-    }}
-    /* Additional styling may be needed for other sidebar elements */
-    .css-1l02zno {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(8px);
-    }}
-    </style>
-    """
-
-    # Inject the CSS with markdown
-    st.markdown(background_image_css, unsafe_allow_html=True)
+    # Shared background and sidebar styling
+    apply_theme()
     st.title('Chroma')
 
-    st.set_option('deprecation.showPyplotGlobalUse', False)
     st.title("Audio Enhancer")
 
     upload_file = st.file_uploader("Upload an audio file", type=["wav"])
 
+    # Long recordings are restored in overlapping chunks, optionally in parallel
+    st.sidebar.subheader("Performance")
+    # A chunk plus its overlap must fit one of VoiceFixer's own segments
+    chunk_seconds = st.sidebar.slider("Chunk length (seconds)", min_value=10,
+                                      max_value=VOICEFIXER_SEGMENT_SECONDS - OVERLAP_SECONDS, value=CHUNK_SECONDS)
+    cpus = os.cpu_count() or 1
+    workers = st.sidebar.number_input("Parallel chunks", min_value=1, max_value=cpus, value=1)
+    show_timings = trace_option()
+
     if upload_file is not None:
-        audiofile, sr = load_audio(upload_file)
+        # The upload is written to this session's scratch directory once; display,
+        # spectrogram and restoration all read that one file
+        try:
+            input_file, upload_key = saved_upload(upload_file, 'audio')
+        except scratch.ScratchFull:
+            st.error("The server is out of scratch space. Please try again later.")
+            return
+        audiofile, sr = load_audio(input_file)
 
         st.write("Original audio")
-        st.audio(audiofile, format='audio/wav', start_time=0, sample_rate=sr)
+        st.audio(upload_file.getvalue(), format='audio/wav', start_time=0)
 
         st.write("Spectrogram of the original audio")
-        show_spectrogram(audiofile, sr, "Spectrogram of the original audio")
+        show_spectrogram(audiofile, sr, "Spectrogram of the original audio", key=upload_key)
 
         if st.button("Enhance"):
-            vf = VoiceFixer()
-
-            second = librosa.get_duration(y=audiofile, sr=sr)
-            rate = sr
-
-            input_file = "out{}_{}.wav".format(second, rate)
-            output_file = "out{}_{}_restored.wav".format(second, rate)
-
-            with open(input_file, 'wb') as f:
-                f.write(upload_file.getvalue())
-
-            vf.restore(input=input_file, output=output_file, cuda=False, mode=0)
-
+            # The output lives next to the upload, so concurrent sessions never share file names
+            workspace = session_workspace('audio')
+            output_file = workspace.file(f"{upload_key[:16]}_restored.wav")
+
+            # Restore on a background worker with the shared VoiceFixer so the page stays responsive
+            st.session_state['enhance_task'] = (upload_key, tasks.submit(
+                restore_in, workspace, input_file, output_file, chunk_seconds=chunk_seconds,
+                workers=int(workers), threads_per_worker=max(1, cpus // int(workers)), mode=0))
+
+        # Poll the restore job started for this upload, if any
+        task_upload, task_id = st.session_state.get('enhance_task', (None, None))
+        task = tasks.get(task_id) if task_upload == upload_key else None
+
+        if task is not None and not task.done():
+            st.progress(task.progress, text=f"{task.message or task.status.capitalize()}... {task.elapsed:.0f}s")
+            if task.preview is not None:
+                st.write("Latest restored chunk")
+                st.audio(task.preview, format='audio/wav', sample_rate=SAMPLE_RATE)
+            time.sleep(1)
+            st.rerun()
+        elif task is not None and task.status == 'failed':
+            st.error(f"Enhancement failed: {task.future.exception()}")
+        elif task is not None and not os.path.exists(task.result()):
+            # Idle session files are swept from scratch space
+            st.info("The enhanced audio has expired. Press Enhance to restore it again.")
+        elif task is not None:
+            output_file = task.result()
             enhanced_audio, enhanced_sr = load_audio(output_file)
 
             st.write("Enhanced audio")
-            st.audio(enhanced_audio, format='audio/wav', start_time=0, sample_rate=enhanced_sr)
+            st.audio(output_file, format='audio/wav', start_time=0)
 
             st.write("Spectrogram of the enhanced audio")
-            show_spectrogram(enhanced_audio, enhanced_sr, "Spectrogram of the enhanced audio")
+            show_spectrogram(enhanced_audio, enhanced_sr, "Spectrogram of the enhanced audio",
+                             key=f"restored-{task_id}")
+            if show_timings:
+                show_trace(task.trace.rows())
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,112 +1,105 @@
 import os
 import streamlit as st
-import cv2
-import numpy as np
-from deoldify import device
-from deoldify.device_id import DeviceId
-from deoldify.visualize import *
-from PIL import Image
-import io
-import tempfile
-import base64
+from core import jobs, metrics, scratch
+from core.cache import results
+from core.pipeline import image_cache_key
+from core.theme import apply_theme
+from core.ui import cache_status, job_progress, precision_option, show_trace, trace_option
 
-def colorize_image(uploaded_file, render_factor, watermarked):
-    # Set up DeOldify
-    device.set(device=DeviceId.GPU0 if torch.cuda.is_available() else DeviceId.CPU)  # Choose GPU if available, else CPU
-    colorizer = get_image_colorizer(artistic=True)
+# Scans are limited by pixel count to fit the per-image memory budget (see
+# core.colorize.max_image_pixels); the byte limit guards disk and bandwidth
+MAX_IMAGE_MB = int(os.environ.get('CHROMA_MAX_IMAGE_MB', '200'))
 
-    # Save the uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-        temp_file_path = temp_file.name
-        uploaded_file.seek(0)
-        temp_file.write(uploaded_file.read())
-
-    # Colorize the image
-    colorized_image_path = colorizer.plot_transformed_image(temp_file_path, render_factor=render_factor, watermarked=watermarked)
+def upload_error(uploaded_file):
+    """Return why the upload cannot be colorized, or None."""
+    from PIL import Image, UnidentifiedImageError
+    from core.colorize import check_image_size
 
-    # Load the colorized image as a PIL Image
-    colorized_image_pil = Image.open(colorized_image_path)
-
-    # Create an in-memory file-like object for the colorized image
-    colorized_img_bytes = io.BytesIO()
-    colorized_image_pil.save(colorized_img_bytes, format='JPEG')
-    colorized_img_bytes.seek(0)
+    if uploaded_file.size > MAX_IMAGE_MB * 2**20:
+        return f"The file is too large. Please upload files less than {MAX_IMAGE_MB}MB."
+    try:
+        # Only the header is read here
+        with Image.open(uploaded_file) as image:
+            check_image_size(*image.size)
+    except (ValueError, Image.DecompressionBombError) as e:
+        return str(e)
+    except UnidentifiedImageError:
+        return "The file could not be read as an image."
+    finally:
+        uploaded_file.seek(0)
+    return None
 
-    # Clean up the temporary file
-    os.remove(temp_file_path)
+def show_result(original_image, colorized_image_path):
+    with open(colorized_image_path, 'rb') as f:
+        colorized_img_bytes = f.read()
 
-    return uploaded_file, colorized_img_bytes
+    # Display the original and colorized images side by side
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader('Original Image')
+        st.image(original_image, use_column_width=True)
+    with col2:
+        st.subheader('Colorized Image')
+        st.image(colorized_img_bytes, use_column_width=True)
+    cache_status()
 
-def get_base64_of_image(file_path):
-    """Encode the image as base64."""
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
-    return encoded_string
+    # Download button for the colorized image
+    st.download_button(label="Download Colorized Image",
+                    data=colorized_img_bytes,
+                    file_name="colorized_image.jpg",
+                    mime="image/jpeg")
 
 def main():
-    # Path to your image
-    image_path = 'static/bg.png'
-    encoded_image = get_base64_of_image(image_path)
-
-    # CSS to inject specifying the background image
-    background_image_css = f"""
-    <style>
-    .stApp {{
-        background-image: url('data:image/png;base64,{encoded_image}');
-        background-size: cover;
-        background-position: center;
-        background-repeat: no-repeat;
-        background-attachment: fixed;
-        color: black;  /* Set text color to black */
-    }}
-    
-    /* Style for the sidebar (white with blur effect) */
-    .stSidebar {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(16px);
-    }}
-    /* Additional styling may be needed for other sidebar elements */
-    .css-1l02zno {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(8px);
-    }}
-    </style>
-    """
-
-    # Inject the CSS with markdown
-    st.markdown(background_image_css, unsafe_allow_html=True)
+    # Shared background and sidebar styling
+    apply_theme()
     st.title('Chroma')
     st.subheader("Image Colorizer")
     st.write("Upload a black and white image to colorize")
     uploaded_file = st.file_uploader("Choose an image...", type=['jpg', 'jpeg', 'png'], accept_multiple_files=False)
     render_factor = st.slider("Render Factor", min_value=7, max_value=40, value=35)
     watermarked = True 
+    precision = precision_option()
+    show_timings = trace_option()
     
     if uploaded_file is not None:
-        file_size_limit = 5000 * 1024  # 5MB limit
-        if uploaded_file.size <= file_size_limit:
+        error = upload_error(uploaded_file)
+        if error is None:
             if st.button("Colorize Image"):
-                # Colorize the image
-                with st.spinner('Colorizing...'):
-                    original_file, colorized_img_bytes = colorize_image(uploaded_file, render_factor, watermarked)
-                    st.success('Colorization complete!')
+                # Serve repeat uploads of the same image and settings from the result cache
+                image_bytes = uploaded_file.getvalue()
+                cache_key = image_cache_key(image_bytes, render_factor, watermarked, precision=precision)
+                cached_path = results.get(cache_key, '.jpg')
 
-                # Display the original and colorized images side by side
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.subheader('Original Image')
-                    st.image(original_file, use_column_width=True)
-                with col2:
-                    st.subheader('Colorized Image')
-                    st.image(colorized_img_bytes, use_column_width=True)
+                if cached_path is None:
+                    # Hand the upload to a background job through a private scratch file;
+                    # the job keeps its own copy, so the scratch directory goes right away
+                    suffix = os.path.splitext(uploaded_file.name)[1] or '.jpg'
+                    try:
+                        with scratch.workspace('image', size_hint=len(image_bytes)) as workspace:
+                            temp_file_path = workspace.file('upload' + suffix)
+                            with open(temp_file_path, 'wb') as temp_file, metrics.stage('upload_write'):
+                                temp_file.write(image_bytes)
 
-                # Download button for the colorized image
-                st.download_button(label="Download Colorized Image",
-                                data=colorized_img_bytes.getvalue(),
-                                file_name="colorized_image.jpg",
-                                mime="image/jpeg")
+                            # Colorize with the shared model on a background job; its id lives in the URL
+                            st.query_params['job'] = jobs.submit('image', temp_file_path, render_factor=render_factor,
+                                                                 watermarked=watermarked, precision=precision,
+                                                                 cache_key=cache_key)
+                    except scratch.ScratchFull:
+                        st.error("The server is out of scratch space. Please try again later.")
+                else:
+                    st.query_params.pop('job', None)
+                    show_result(uploaded_file, cached_path)
         else:
-            st.error("The file is too large. Please upload files less than 5MB.")
+            st.error(error)
+
+    # Follow the colorization job, if one was started from this page
+    if 'job' in st.query_params:
+        job = job_progress(st.query_params['job'], unit='images')
+        if job is not None:
+            st.success('Colorization complete!')
+            show_result(job.input, job.result)
+            if show_timings:
+                show_trace(job.trace)
 
 if __name__ == "__main__":
     main()
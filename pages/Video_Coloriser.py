@@ -1,180 +1,128 @@
-import streamlit as st
-import cv2
-import numpy as np
-from deoldify import device
-from deoldify.device_id import DeviceId
-from deoldify.visualize import *
-import tempfile
 import os
-import moviepy.editor as mp
-
-# Function to colorize the video frames using DeOldify
-def colorize_video(video_file, render_factor):
-    try:
-        # Set up DeOldify
-        device.set(device=DeviceId.GPU0 if torch.cuda.is_available() else DeviceId.CPU)
-        colorizer = get_video_colorizer()
-
-        # Create a temporary directory to save the uploaded video frames
-        temp_dir = tempfile.mkdtemp()
-
-        # Save the uploaded video to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-            temp_file_path = temp_file.name
-            video_file.seek(0)
-            temp_file.write(video_file.read())
-
-        # Colorize the video
-        colorized_video_path = colorizer.colorize_from_file_name(temp_file_path, render_factor=render_factor)
-
-        # Clean up the temporary video file
-        os.remove(temp_file_path)
-
-        return colorized_video_path
-    except Exception as e:
-        st.error(f"Error: {e}")
-        st.error("An error occurred while colorizing the video. Please check the file format and try again.")
-
-# Function to add audio to the colorized video
-def add_audio(video_file, audio_file, colorized_frames, temp_dir):
-    # Compile colorized frames into video without audio
-    temp_video_path = os.path.join(temp_dir, 'colorized_temp.mp4')
-    frame_height, frame_width, _ = colorized_frames[0].shape
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(temp_video_path, fourcc, 24.0, (frame_width, frame_height))
-    for frame in colorized_frames:
-        out.write(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))  # Convert color format to RGB before writing
-    out.release()
-
-    # Add audio to the colorized video
-    video = mp.VideoFileClip(temp_video_path)
-    audio = mp.AudioFileClip(audio_file)
-    video = video.set_audio(audio)
-    video.write_videofile("colorized_temp_with_audio.mp4", codec="libx264", audio_codec="aac")
-
-def get_base64_of_image(file_path):
-    """Encode the image as base64."""
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
-    return encoded_string
+import streamlit as st
+from core import jobs, scratch
+from core.cache import results
+from core.pipeline import video_cache_key
+from core.preview import PREVIEW_FPS, PREVIEW_HEIGHT, PREVIEW_SECONDS, preview_clip, preview_frames
+from core.theme import apply_theme
+from core.ui import (cache_status, job_progress, saved_upload, session_workspace, show_trace, trace_option,
+                     video_options)
+
+# Show the original and colorized videos and offer the result for download
+def show_result(video_file_path, colorized_video_path):
+    # Display original video
+    st.subheader("Original Video")
+    st.video(video_file_path)
+
+    # Display colorized video with audio
+    st.subheader('Colorized Video with Audio')
+    st.video(colorized_video_path)
+
+    # Display colorized video with audio
+    st.subheader('The Colorized Video is Downloaded')
+
+    # Offer the option to download the colorized video
+    st.text("Download colorized video:")
+    with open(colorized_video_path, "rb") as f:
+        bytes_data = f.read()
+    st.download_button(
+        label="Click here to download",
+        data=bytes_data,
+        file_name="colorized_video_with_audio.mp4",
+        mime="video/mp4",
+    )
+
+# Colorize a few low-resolution frames (or the first seconds) so the render factor can be tuned quickly
+def show_preview(video_file_path, content_hash, render_factor, precision):
+    mode = st.radio("Preview", ["Frames across the video", f"First {PREVIEW_SECONDS} seconds"], horizontal=True)
+    # Previews of earlier uploads are dropped
+    if st.session_state.get('video_previews', {}).get('hash') != content_hash:
+        st.session_state['video_previews'] = {'hash': content_hash}
+    previews = st.session_state['video_previews']
+    key = (render_factor, precision, mode)
+    if st.button("Preview") and key not in previews:
+        with st.spinner(f"Colorizing a {PREVIEW_HEIGHT}p preview..."):
+            if mode.startswith("Frames"):
+                previews[key] = preview_frames(video_file_path, render_factor, precision=precision)
+            else:
+                workspace = session_workspace('video')
+                clip_path = workspace.file(f'preview-{render_factor}-{precision}.mp4')
+                with workspace.busy():
+                    preview_clip(video_file_path, clip_path, render_factor, precision=precision)
+                previews[key] = clip_path
+
+    preview = previews.get(key)
+    if isinstance(preview, str) and not os.path.exists(preview):
+        # Swept from scratch space after the session sat idle
+        del previews[key]
+        preview = None
+    if preview is None:
+        return
+    st.caption(f"Preview at render factor {render_factor}, {PREVIEW_HEIGHT}p")
+    if isinstance(preview, str):
+        st.video(preview)
+        st.caption(f"{PREVIEW_FPS} frames per second, no audio")
+    else:
+        columns = st.columns(3)
+        for i, (seconds, image) in enumerate(preview):
+            columns[i % 3].image(image, caption=f"{seconds:.1f}s", use_column_width=True)
 
 # Main function to run the Streamlit app
 def main():
-    # Path to your image
-    image_path = 'static/bg.png'
-    encoded_image = get_base64_of_image(image_path)
-    # CSS to inject specifying the background image
-    background_image_css = f"""
-    <style>
-    .stApp {{
-        background-image: url('data:image/png;base64,{encoded_image}');
-        background-size: cover;
-        background-position: center;
-        background-repeat: no-repeat;
-        background-attachment: fixed;
-        color: black;  /* Set text color to black */
-    }}
-    
-    /* Style for the sidebar (white with blur effect) */
-    .stSidebar {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(16px);
-    }}
-    /* Additional styling may be needed for other sidebar elements */
-    .css-1l02zno {{
-        background-color: #ba90e3; /* Change sidebar color */
-        backdrop-filter: blur(8px);
-    }}
-    </style>
-    """
-    # Inject the CSS with markdown
-    st.markdown(background_image_css, unsafe_allow_html=True)
+    # Shared background and sidebar styling
+    apply_theme()
     st.title('Chroma')
     st.subheader("Video Colorizer")
     st.write("Upload a black and white video to colorize")
-    
-    # Set up DeOldify
-    device.set(device=DeviceId.GPU0)  # or DeviceId.CPU if using CPU
-    colorizer = get_image_colorizer(artistic=True)
 
     uploaded_file = st.file_uploader("Choose a video file...", type=["mp4"])
+    show_timings = trace_option()
 
     if uploaded_file is not None:
-        # Create a temporary directory to save the uploaded video and audio
-        temp_dir = tempfile.mkdtemp()
-        video_file_path = os.path.join(temp_dir, 'video.mp4')
-        audio_file_path = os.path.join(temp_dir, 'audio.mp3')
-
-        # Save the uploaded video to a temporary file
-        with open(video_file_path, 'wb') as f:
-            f.write(uploaded_file.read())
-
-        # Extract audio from the uploaded video and save it as a temporary file
-        video = mp.VideoFileClip(video_file_path)
-        audio = video.audio
-        audio.write_audiofile(audio_file_path)
-
-        # Read the video from the temporary file
-        cap = cv2.VideoCapture(video_file_path)
-
-        # Initialize lists to store colorized frames
-        colorized_frames = []
+        # The upload is saved to this session's scratch directory once, not on every rerun
+        try:
+            video_file_path, content_hash = saved_upload(uploaded_file, 'video')
+        except scratch.ScratchFull:
+            st.error("The server is out of scratch space. Please try again later.")
+            return
 
         # Add a slider to select the render factor
         render_factor = st.slider("Select Render Factor", min_value=1, max_value=40, value=10)
 
+        # Batching and CPU worker pool settings
+        options = video_options()
+
+        # A quick low-resolution look before committing to the full job
+        show_preview(video_file_path, content_hash, render_factor, options['precision'])
+
        # Add a button to initiate colorization
         if st.button("Colorize"):
-            # Colorize the video frame by frame
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-
-                # Convert frame to bytes
-                _, buffer = cv2.imencode('.jpg', frame)
-                byte_frame = buffer.tobytes()
-
-                # Save byte stream as an image file
-                temp_image_path = os.path.join(temp_dir, 'temp_image.jpg')
-                with open(temp_image_path, 'wb') as f:
-                    f.write(byte_frame)
-
-                # Colorize the frame
-                with st.spinner('Colorizing...'):
-                    colorized_frame_pil = colorizer.get_transformed_image(temp_image_path, render_factor=render_factor, post_process=True)
-                    colorized_frame_np = np.array(colorized_frame_pil)
-
-                # Append the colorized frame to the list
-                colorized_frames.append(colorized_frame_np)
-
-            # Release the video capture object and delete the temporary files
-            cap.release()
-
-            # Compile colorized frames into video with audio
-            add_audio(video_file_path, audio_file_path, colorized_frames, temp_dir)
-
-            # Display original video
-            st.subheader("Original Video")
-            st.video(video_file_path)
-
-            # Display colorized video with audio
-            st.subheader('Colorized Video with Audio')
-            st.video("colorized_temp_with_audio.mp4")
-
-            # Display colorized video with audio
-            st.subheader('The Colorized Video is Downloaded')
-
-            # Offer the option to download the colorized video
-            st.text("Download colorized video:")
-            with open("colorized_temp_with_audio.mp4", "rb") as f:
-                bytes_data = f.read()
-            st.download_button(
-                label="Click here to download",
-                data=bytes_data,
-                file_name="colorized_video_with_audio.mp4",
-                mime="video/mp4",
-            )
+            # Serve a previous result for the same video and settings if there is one
+            cache_key = video_cache_key(video_file_path, render_factor, options, content_hash=content_hash)
+            colorized_video_path = results.get(cache_key, '.mp4')
+
+            if colorized_video_path is None:
+                # Colorize on a background job that checkpoints as it goes; its id
+                # lives in the URL so a refresh picks the job back up
+                try:
+                    st.query_params['job'] = jobs.submit('video', video_file_path, render_factor=render_factor,
+                                                         options=options, cache_key=cache_key)
+                except scratch.ScratchFull:
+                    st.error("The server is out of space for new jobs. Please try again later.")
+            else:
+                st.query_params.pop('job', None)
+                cache_status()
+                show_result(video_file_path, colorized_video_path)
+
+    # Follow the colorization job, if one was started from this page
+    if 'job' in st.query_params:
+        job = job_progress(st.query_params['job'])
+        if job is not None:
+            st.caption(job.message)
+            cache_status()
+            show_result(job.input, job.result)
+            if show_timings:
+                show_trace(job.trace)
 
 if __name__ == "__main__":
     main()